@@ -9,13 +9,36 @@ Modified for Pin definition for Raspberry Pico
 LCD_WIDTH = 20  # n characters wide
 LCD_LINES = 4   # LCD number of lines
 DELAY = 0.002   # seconds between writes
+DELAY_CLEAR = 0.002     # clear and home take 1.52 ms to execute in the LCD
+
+# PCF8574 port bits
+MASK_RS = 0x01  # RS (1=data, 0=command)
+MASK_EN = 0x04  # EN (data is latched on falling edge)
+MASK_BL = 0x08  # backlight
 
 class LCD:
 
-    def __init__(self, i2c, addr=0x27, bl=True):
+    def __init__(self, i2c, addr=0x27, bl=True, buffered=True):
         self.LCD_ADDR = addr
         self.BLEN = True
         self.i2c = i2c
+
+        # In buffered mode every byte to the LCD is encoded as 4 bus bytes
+        # (high nibble with EN high, then EN low, then same for the low
+        # nibble) and a whole command or string goes out in one writeto().
+        # No sleeps needed: at 100 kHz each bus byte takes ~90 us, longer
+        # than the 37 us the LCD needs per character or command.
+        # Buffer is big enough for a cursor move plus a full line.
+        self.buffered = False   # init sequence needs the slow path
+        self._buf = bytearray(4 * (LCD_WIDTH + 1))
+        self._mv = memoryview(self._buf)
+
+        # Frame is what should be on the screen, shadow is what was last
+        # sent to it. flush() sends only the difference. Both are one byte
+        # per character, line by line.
+        self._frame = bytearray(b' ' * (LCD_WIDTH * LCD_LINES))
+        self._shadow = bytearray(self._frame)
+        self._cursor = None     # LCD cursor address command, None if unknown
         seq = [
             0x33,   # Must initialize to 8-line mode at first
             0x32,   # Then initialize to 4-line mode
@@ -27,7 +50,7 @@ class LCD:
             self.send_command(data)
             time.sleep(DELAY * 2)
         self.write_byte(0x08)
-
+        self.buffered = buffered
 
     def write_byte(self, data):
         #print("I2C.writeto()", end="") #DEBUG
@@ -41,7 +64,45 @@ class LCD:
             data &= 0xF7
         self.write_byte(data)
 
+    def _encode(self, pos, data, rs):
+        # Encode one LCD byte as 4 bus bytes into the buffer at pos. Returns
+        # the next free position.
+        bits = rs | MASK_BL if self.BLEN else rs
+        buf = self._buf
+        hi = (data & 0xF0) | bits
+        lo = ((data & 0x0F) << 4) | bits
+        buf[pos] = hi | MASK_EN
+        buf[pos + 1] = hi
+        buf[pos + 2] = lo | MASK_EN
+        buf[pos + 3] = lo
+        return pos + 4
+
+    def _flush(self, pos):
+        # Send the first pos bytes of the buffer in one I2C transaction
+        if pos:
+            self.i2c.writeto(self.LCD_ADDR, self._mv[:pos])
+
+    def send_commands(self, cmds):
+        """Send a sequence of commands. Uses a single I2C transaction per
+        buffer full in buffered mode."""
+        self._cursor = None
+        if not self.buffered:
+            for cmd in cmds:
+                self.send_command(cmd)
+            return
+        pos = 0
+        for cmd in cmds:
+            if pos == len(self._buf):
+                self._flush(pos)
+                pos = 0
+            pos = self._encode(pos, cmd, 0)
+        self._flush(pos)
+
     def send_command(self, cmd):
+        self._cursor = None
+        if self.buffered:
+            self._flush(self._encode(0, cmd, 0))
+            return
 
         # Bit positions
         # +---------b7 or b3
@@ -72,6 +133,11 @@ class LCD:
         self.write_word(buf)
 
     def send_data(self, data):
+        self._cursor = None
+        if self.buffered:
+            self._flush(self._encode(0, data, MASK_RS))
+            return
+
         # Send bit7-4 firstly
         buf = data & 0xF0
         buf |= 0x05               # RS = 1, RW = 0, EN = 1
@@ -93,6 +159,14 @@ class LCD:
     def clear(self):
         """Clear Screen"""
         self.send_command(0x01)
+        if self.buffered:
+            time.sleep(DELAY_CLEAR)
+        frame = self._frame
+        shadow = self._shadow
+        for i in range(len(frame)):
+            frame[i] = 0x20
+            shadow[i] = 0x20
+        self._cursor = 0x80     # clear also homes the cursor
 
     def backlight(self, ena=None):
         """Enable the backlight."""
@@ -105,8 +179,8 @@ class LCD:
         self.BLEN  = ena
         self.write_byte(buf)
 
-    def write(self, x, y, text):
-        """Write text starting at position (x,y)"""
+    def _clip(self, x, y):
+        # Keep position on the screen. Returns index of the cell in the frame.
         if x < 0:
             x = 0
         if x > LCD_WIDTH - 1:
@@ -115,21 +189,96 @@ class LCD:
             y = 0
         if y > LCD_LINES - 1:
             y = LCD_LINES - 1
+        return y * LCD_WIDTH + x
+
+    def draw(self, x, y, text):
+        """Put text starting at position (x,y) into the frame without sending
+        it. text is a str, or bytes / bytearray of character codes. Text past
+        the end of the line is dropped. Call flush() to update the LCD."""
+        if isinstance(text, str):
+            text = text.encode()
+        frame = self._frame
+        i = self._clip(x, y)
+        end = i - i % LCD_WIDTH + LCD_WIDTH
+        for ch in text:
+            if i >= end:
+                break
+            frame[i] = ch
+            i += 1
 
-        # Move cursor
-        addr = 0x80 + x + 0x40*(y % 2) + 0x14*(y > 1)
-        self.send_command(addr)
+    def flush(self):
+        """Send only the characters of the frame that differ from what is
+        already on the LCD. Changed characters close together are combined
+        into runs so each run needs at most one cursor move."""
+        frame = self._frame
+        shadow = self._shadow
+        for y in range(LCD_LINES):
+            i = y * LCD_WIDTH
+            end = i + LCD_WIDTH
+            while i < end:
+                if frame[i] == shadow[i]:
+                    i += 1
+                    continue
+                # Bridging one unchanged character costs the same as the
+                # cursor move it saves
+                j = i + 1
+                while j < end:
+                    if frame[j] != shadow[j]:
+                        j += 1
+                    elif j + 1 < end and frame[j + 1] != shadow[j + 1]:
+                        j += 2
+                    else:
+                        break
+                self._send_run(y, i, j)
+                i = j
+
+    def _send_run(self, y, i, j):
+        # Send frame[i:j] (all on line y) and update the shadow copy
+        frame = self._frame
+        shadow = self._shadow
+        addr = 0x80 + (i - y * LCD_WIDTH) + 0x40*(y % 2) + 0x14*(y > 1)
+        if not self.buffered:
+            if addr != self._cursor:
+                self.send_command(addr)
+            for k in range(i, j):
+                self.send_data(frame[k])
+                shadow[k] = frame[k]
+        else:
+            pos = 0
+            if addr != self._cursor:
+                pos = self._encode(0, addr, 0)
+            for k in range(i, j):
+                if pos == len(self._buf):
+                    self._flush(pos)
+                    pos = 0
+                pos = self._encode(pos, frame[k], MASK_RS)
+                shadow[k] = frame[k]
+            self._flush(pos)
+        # The LCD moves the cursor after each character. With 20 chars per
+        # line the end of line 0 runs on into line 2, and 1 into 3.
+        self._cursor = addr + j - i
+
+    def invalidate(self):
+        """Forget what is on the LCD so the next flush() sends the whole
+        frame. Use this if the LCD may have been reset."""
+        shadow = self._shadow
+        for i in range(len(shadow)):
+            shadow[i] = 0
+        self._cursor = None
+
+    def write(self, x, y, text):
+        """Write text (a str, or bytes / bytearray) starting at position
+        (x,y). Only characters that changed are sent."""
+        self.draw(x, y, text)
+        self.flush()
 
-        if len(text) > 0:
-            for ch in text:
-                self.send_data(ord(ch))
-        
     def write_screen(self, text):
         """Clear the screen and write the text contained in text. Line
         breaks are \n."""
         self.clear()
         for line, txt in enumerate(text.split('\n')):
-            self.write(0, line, txt)
+            self.draw(0, line, txt)
+        self.flush()
 
     def cursor_show(self, ena):
         if ena:
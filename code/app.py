@@ -0,0 +1,449 @@
+import uasyncio as asyncio
+import time
+from machine import Pin
+try:
+    from machine import lightsleep
+except ImportError:
+    lightsleep = None
+import wifi
+import button
+import flowcounter
+import therm_ds18
+import pressure
+import sampleq
+import ntptime
+import thingspeak
+import scheduler
+
+# Application core shared by run_lcd and run_oled. Each job runs as its own
+# uasyncio task so a slow job (e.g. a post over a poor hotspot link) only
+# holds up itself:
+#   _button   -- waits for button events. A press wakes the display, a
+#                long press also shows the IP and posts what is queued now.
+#   _display  -- refreshes the readings every second, blanks after timeout
+#   _sample   -- reads flow, flow rate and pressure every second
+#   _wifi     -- connects and reconnects to the hotspot
+#   _period   -- temperature conversion and sample into the queue on flash
+#   _upload   -- posts queued samples to Thingspeak when connected. With a
+#                channel_id in config.json, timestamped samples go up
+#                post_batch at a time in one bulk update.
+#   _radio    -- with radio_duty in config.json, turns the WiFi radio off
+#                between uploads. Logs radio on time per day either way.
+#   _idle     -- with light_sleep in config.json, idles the CPU in light
+#                sleep while the radio is off. See lowpower.py for a deep
+#                sleep mode without flow counting.
+#
+# The once a second readings, the temperature conversion and the sample run
+# on scheduler deadlines, so they keep to the POST_RATE grid however late a
+# run is. All three use catchup=False: a job that falls a period or more
+# behind runs once and skips to its next deadline, counting the skipped
+# ones as missed. Lateness per job is printed with the power log each day.
+#
+# The display front end is a view object with these methods:
+#   visible()           -- True if display is on
+#   wake(), blank()     -- turn display on/off
+#   show_ip(ip)         -- show the IP address
+#   show(mgal, mgpm, mtempF, mpsi, sts)  -- show readings, as integers in
+#                       milli-units. sts is a 3 char status, or an int of
+#                       seconds to the next sample.
+#
+# Readings for the display are kept as milli-unit integers (see fixfmt) so
+# the once a second loop does no float math.
+
+# CONSTANTS
+GPIO_BUTTON = 0             # onboard button is on GPIO0
+PIN_FLOWCOUNTER = 14
+PIN_1WIRE = 13
+TEMP_SENSOR = 'temp'        # Name of the 1-Wire sensor in field 3
+POST_RATE = 360             # Update Thingspeak every N seconds
+FIRST_POST = 30             # Take first sample N seconds after boot
+DISP_TIMEOUT = 60           # Show display for N seconds when button is pressed
+TEMP_POLL_MS = 100          # Check for temperature conversion done every N ms
+CONV_LEAD = 30              # Do a temperature conversion N seconds ahead of post
+IP_SHOW = 2                 # Show IP address for N seconds after connecting
+POST_STS_SHOW = 2           # Show post status for N seconds after posting
+NTP_RETRY = 60              # Until the clock is set, try NTP every N seconds while connected
+PSI_TRIG_SLOPE = 5.0        # Capture a transient on a jump of N psi between ADC samples
+TRANSIENT_FILE = 'transient.txt'    # Last captured transient
+TRANSIENT_GAP = 60          # Capture a transient at most every N seconds, to spare the flash
+
+# Thingspeak fields, in queue record order, and their decimal places:
+#   1 gallons, 2 psi, 3 temperature F,
+#   4, 5, 6 psi min, max and mean over the period,
+#   7 flow sensor glitches rejected over the period
+FIELD_DEC = (3, 1, 2, 1, 1, 1, 0)
+QUEUE_FILE = 'samples.dat'
+QUEUE_SLOTS = 240           # 240 x 36 bytes = 8.4 kB, a day of 6 minute samples
+DRAIN_GAP = 15              # Thingspeak takes one update per 15 seconds
+RADIO_LEAD = 20             # With radio_duty, turn the radio on N seconds before a batch is due,
+RADIO_WINDOW = 120          # and off again once it's sent, or after N seconds
+POWER_LOG = 'power.log'     # Each day: date, radio on seconds, radio windows, max wake to post ms
+LIGHT_SLEEP_MS = 50         # With light_sleep, idle the CPU up to N ms at a time while the radio is off
+POWER_LOG_PERIOD = 86400
+
+
+def make_therm(config):
+    # OneWire bus and temp sensors. 1wire_addr1 is the one posted, more can
+    # be named in 1wire.
+    sensors = dict(config.get('1wire', {}))
+    if '1wire_addr1' in config:
+        sensors[TEMP_SENSOR] = config['1wire_addr1']
+    return therm_ds18.Bus(Pin(PIN_1WIRE), sensors)
+
+
+class App:
+
+    def __init__(self, config, view):
+        self.config = config
+        self.view = view
+
+        # Button press shows display for a few seconds
+        self.btn = button.Button(Pin(GPIO_BUTTON, Pin.IN, Pin.PULL_UP), activelow=True)
+
+        # Setup OneWire bus and temp sensors
+        self.therm = make_therm(config)
+
+        # Water flow sensor. Edges closer than flow_min_us are counted as
+        # glitches, not water. flow_cal is the calibration curve.
+        self.flow = flowcounter.FlowCount(Pin(PIN_FLOWCOUNTER, Pin.IN, Pin.PULL_UP),
+            min_us=config.get('flow_min_us', flowcounter.MIN_PULSE_US),
+            cal=config.get('flow_cal'))
+        self.glitches = 0                       # flow glitch total at last sample
+
+        # Water pressure. Transients trigger on a fast change, or on going
+        # above or below the psi_trig_hi / psi_trig_lo in config.json.
+        self.press = pressure.Pressure(
+            trig_hi=config.get('psi_trig_hi'),
+            trig_lo=config.get('psi_trig_lo'),
+            trig_slope=config.get('psi_trig_slope', PSI_TRIG_SLOPE))
+
+        # Hotspot. Force disconnect in case it was on an old hotspot name.
+        self.wi = wifi.WIFI(config['hostname'])
+        wifi.resolver.ttl = config.get('dns_ttl', wifi.DNS_TTL)
+        self.wi.disconnect()
+
+        # Samples waiting to be posted. Kept on flash over reboots.
+        self.queue = sampleq.SampleQueue(QUEUE_FILE, QUEUE_SLOTS)
+        self._drain = asyncio.Event()
+
+        # Bulk or single updates, and how many to post at a time
+        self.up = thingspeak.Uploader(config, FIELD_DEC)
+        self.post_batch = self.up.batch
+
+        # Radio duty cycling. The first window is at boot, to set the clock.
+        self.radio_duty = config.get('radio_duty', False)
+        self._uploading = False
+        self._post_now = False                  # long press: post without a full batch
+        self._windows = 0                       # radio windows since last log
+        self._power_on_s = 0                    # radio on seconds at last log
+        self._t_window = time.ticks_ms()        # radio on, until the first post
+        self._lat_max = 0                       # longest radio on to post ms since last log
+        self.light_sleep = config.get('light_sleep', False) and lightsleep is not None
+
+        # Add to time.time() to get real time. None until NTP has answered.
+        self.clock_offset = None
+
+        # Latest readings, milli-units
+        self.mgal = 0
+        self.mgpm = 0
+        self.mpsi = 0
+        self.mtempF = therm_ds18.NO_TEMP_M
+        self.tempF = therm_ds18.NO_TEMP         # for the queue
+
+        tm_now = time.time()
+        self.sts = ''                           # wifi status short code
+        self.post_sts = ''                      # status of last post
+        self.tm_blank = tm_now + DISP_TIMEOUT
+        self.tm_hold = 0                        # don't show readings until then
+        self.tm_post_sts = 0                    # show post status until then
+        self.tm_rearm = 0                       # transient saved, next capture from then
+        self.tm_ntp = 0                         # next try to set the clock
+        self.tm_boot = tm_now
+        self.tm_radio_off = tm_now + RADIO_WINDOW
+        self.tm_power_log = tm_now + POWER_LOG_PERIOD
+
+        # Deadlines, in ms from now
+        self.sched = scheduler.Scheduler()
+        self.job_read = self.sched.every('read', 1000)
+        self.job_conv = self.sched.every('conv', POST_RATE * 1000, (FIRST_POST - CONV_LEAD) * 1000)
+        self.job_post = self.sched.every('post', POST_RATE * 1000, FIRST_POST * 1000)
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        # Get an updated temperature
+        await self._read_temps()
+
+        await asyncio.gather(
+            self._button(),
+            self._display(),
+            self._sample(),
+            self._wifi(),
+            self._period(),
+            self._upload(),
+            self._radio(),
+            self._idle())
+
+    async def _button(self):
+        # The button IRQ queues the events, nothing runs between them
+        while True:
+            ev = await self.btn.wait_async()
+            if ev == button.PRESS or ev == button.LONG:
+                self.tm_blank = time.time() + DISP_TIMEOUT
+                self.view.wake()
+            if ev == button.LONG:
+                self._upload_now()
+
+    def _upload_now(self):
+        # Long press: show the IP, and post the queue without waiting for a
+        # full batch, turning the radio on for it if off
+        now = time.time()
+        if self.sts == 'con':
+            self.view.show_ip(self.wi.ip)
+            self.tm_hold = now + IP_SHOW
+        elif self.radio_duty and not self.wi.radio_is_on:
+            self._radio_on(now)
+        self._post_now = True
+        self._drain.set()
+
+    async def _display(self):
+        while True:
+            tm_now = time.time()
+            if tm_now >= self.tm_hold:
+                if tm_now < self.tm_post_sts:
+                    sts = self.post_sts
+                elif self.sts == 'con':
+                    sts = self._post_in_s()
+                else:
+                    sts = self.sts
+                self.view.show(self.mgal, self.mgpm, self.mtempF, self.mpsi, sts)
+
+            # Blank the display after timeout
+            if self.view.visible() and tm_now >= self.tm_blank:
+                self.view.blank()
+            await asyncio.sleep(1)
+
+    async def _sample(self):
+        # These measurements update every second. Temperature is updated
+        # only just before post.
+        while True:
+            self.flow.update()
+            self.mgal = self.flow.volume_mgal()
+            self.mgpm = self.flow.rate_mgpm()
+            self.mpsi = self.press.read_mpsi(clip=True)
+            self.mtempF = self.therm.temp_mF(TEMP_SENSOR)
+            self._save_transient()
+            await self.job_read.wait()
+
+    def _save_transient(self):
+        # Write out a captured pressure transient: trigger time, then psi of
+        # each sample. Only the last one is kept. The trigger is rearmed
+        # TRANSIENT_GAP after a save, so a noisy pressure near a trigger
+        # level doesn't rewrite the file every second.
+        cap = self.press.capture()
+        if cap is None:
+            return
+        if self.tm_rearm:
+            if time.time() >= self.tm_rearm:
+                self.tm_rearm = 0
+                self.press.rearm()
+            return
+        ticks, pre, samples = cap
+        try:
+            with open(TRANSIENT_FILE, 'w') as f:
+                f.write('{} {} {} {}\n'.format(time.time(), ticks, pre, self.press.rate_hz))
+                for raw in samples:
+                    f.write('{}\n'.format(self.press.capture_psi(raw)))
+        except OSError:
+            pass
+        print('Pressure transient at', ticks)    #DEBUG
+        self.tm_rearm = time.time() + TRANSIENT_GAP
+
+    async def _wifi(self):
+        # Check wifi connection. Show reconnects with IP addr.
+        ssid = self.config['ssid']
+        pwd = self.config['pwd']
+        while True:
+            if self.wi.radio_is_on:
+                sts = self.wi.check(ssid, pwd)
+            else:
+                sts = 'off'
+            if sts == 'con':
+                # DNS blocks every task, so Thingspeak is looked up here and
+                # not when posting. Takes no time while the address is fresh.
+                self.wi.resolve_url(thingspeak.URL_POST)
+            if sts != self.sts:
+                print(sts, self.wi.is_connected, self.wi.ip, time.localtime()[0:6])   #DEBUG
+                if sts == 'con':
+                    self.view.show_ip(self.wi.ip)
+                    self.tm_hold = time.time() + IP_SHOW
+                    self._sync_clock()
+                    # Send what queued up while offline. A duty cycled
+                    # window opens ahead of the sample that makes up the
+                    # batch, so wait for that one.
+                    if (not self.radio_duty or self._post_now or
+                            len(self.queue) >= self.post_batch):
+                        self._drain.set()
+            elif sts == 'con' and self.clock_offset is None and time.time() >= self.tm_ntp:
+                self._sync_clock()
+            self.sts = sts
+            await asyncio.sleep(1)
+
+    def _sync_clock(self):
+        # Get the offset to real time for timestamping samples. The RTC is
+        # left alone so the tm_* times don't jump.
+        if self.clock_offset is not None:
+            return
+        self.tm_ntp = time.time() + NTP_RETRY
+        try:
+            self.clock_offset = ntptime.time() - time.time()
+        except (OSError, IndexError, ValueError):
+            pass
+
+    async def _read_temps(self):
+        # Convert and read the 1-Wire sensors without holding up the other
+        # tasks. Bad readings are retried by the bus.
+        self.therm.start_conv()
+        while not self.therm.ready():
+            await asyncio.sleep_ms(TEMP_POLL_MS)
+        self.tempF = round(self.therm.temp_F(TEMP_SENSOR), 2)
+        self.mtempF = self.therm.temp_mF(TEMP_SENSOR)
+        print('1-Wire', self.therm.result())  #DEBUG
+
+    async def _period(self):
+        while True:
+            # Do a temperature conversion (1 wire) ahead of sample
+            await self.job_conv.wait()
+            await self._read_temps()
+            await self.job_post.wait()
+
+            # Get water volume. Reset water volume.
+            pulses, liters, interval = self.flow.snapshot_and_reset()
+            gal = liters * flowcounter.CONV_L_TO_GAL
+            glitches = self.flow.glitches
+            nglitch = glitches - self.glitches
+            self.glitches = glitches
+            psi = self.press.read_psi(clip=True)
+            pmin, pmax, pmean, cnt = self.press.period_stats()
+            if not cnt:
+                pmin = pmax = pmean = psi
+
+            # Queue it whether or not the hotspot is up
+            ts = 0
+            if self.clock_offset is not None:
+                ts = time.time() + self.clock_offset
+            self.queue.put(ts, (gal, psi, self.tempF, pmin, pmax, pmean, nglitch))
+            if len(self.queue) >= self.post_batch:
+                self._drain.set()
+
+    async def _upload(self):
+        # Post queued samples oldest first while connected. Stop at the
+        # first failure and try again after the next sample. With
+        # radio_duty, also stop at the end of the radio window; the rest
+        # goes in the next one.
+        while True:
+            await self._drain.wait()
+            self._drain.clear()
+            self._uploading = True
+            while len(self.queue) and self.sts == 'con' and not self._window_over():
+                n = self.up.count(self.queue.peek)
+                self.post_sts = await self.up.post(self.wi, self.queue.peek, n)
+                self.tm_post_sts = time.time() + POST_STS_SHOW
+                print(self.post_sts, n, len(self.queue))  #DEBUG
+                if self.post_sts != 'ook':
+                    break
+                if self._t_window is not None:
+                    lat = time.ticks_diff(time.ticks_ms(), self._t_window)
+                    self._lat_max = max(self._lat_max, lat)
+                    self._t_window = None
+                self.queue.drop(n)
+                if len(self.queue) and not self._window_over():
+                    await asyncio.sleep(DRAIN_GAP)
+            if not len(self.queue):
+                self._post_now = False
+            self.queue.save()
+            self._uploading = False
+
+    def _window_over(self):
+        return self.radio_duty and time.time() >= self.tm_radio_off
+
+    def _next_batch(self):
+        # Time the next upload is due: when the sample that makes up a batch
+        # is taken. A batch left over from a failed window goes at the next
+        # sample.
+        need = max(self.post_batch - len(self.queue), 1)
+        return time.time() + self._post_in_s() + (need - 1) * POST_RATE
+
+    def _post_in_s(self):
+        # Seconds to the next sample
+        return max(self.job_post.in_ms(), 0) // 1000
+
+    async def _radio(self):
+        # Sampling and flow counting carry on while the radio is off. The
+        # queue holds the samples until the next window. The window stays
+        # open until the batch is sent, or RADIO_WINDOW runs out. Either
+        # way not while a request is in flight: _upload() stops at the end
+        # of the window and the radio goes off once it's back.
+        while True:
+            now = time.time()
+            if self.radio_duty:
+                if self.wi.radio_is_on:
+                    done = (not self._uploading and not len(self.queue) and
+                        self.clock_offset is not None)
+                    if done or (now >= self.tm_radio_off and not self._uploading):
+                        self.wi.radio(False)
+                        print('radio off', self.wi.radio_on_s())  #DEBUG
+                elif now >= self._next_batch() - RADIO_LEAD:
+                    self._radio_on(now)
+            if now >= self.tm_power_log:
+                self._log_power(now)
+            await asyncio.sleep(1)
+
+    def _radio_on(self, now):
+        # Open a radio window
+        self.wi.radio(True)
+        self._t_window = time.ticks_ms()
+        self.tm_radio_off = now + RADIO_WINDOW
+        self._windows += 1
+
+    async def _idle(self):
+        # The radio has to be off for the CPU to sleep. Pin IRQs still come
+        # in, but the pressure Timer is a soft one on the ESP8266: its
+        # callbacks are only scheduled during a nap and run back to back
+        # after it. So a nap is no longer than one pressure sample, and
+        # there is none while a transient capture is filling. Each nap also
+        # holds up the other tasks.
+        nap = LIGHT_SLEEP_MS
+        if self.press.rate_hz:
+            nap = min(nap, 1000 // self.press.rate_hz)
+        while True:
+            if (self.light_sleep and not self.wi.radio_is_on and
+                    not self.press.capturing()):
+                lightsleep(nap)
+                await asyncio.sleep_ms(0)
+            else:
+                await asyncio.sleep(1)
+
+    def _log_power(self, now):
+        # Append the last day's radio on seconds, number of windows and the
+        # longest time from radio on to a post going through. The date is
+        # the real one if the clock is set, else days since boot.
+        self.tm_power_log += POWER_LOG_PERIOD
+        on_s = self.wi.radio_on_s()
+        if self.clock_offset is not None:
+            day = '{:04d}-{:02d}-{:02d}'.format(*time.localtime(now + self.clock_offset)[0:3])
+        else:
+            day = 'boot+{}d'.format((now - self.tm_boot) // 86400)
+        try:
+            with open(POWER_LOG, 'a') as f:
+                f.write('{} {} {} {}\n'.format(day, on_s - self._power_on_s, self._windows,
+                    self._lat_max))
+        except OSError:
+            pass
+        self._power_on_s = on_s
+        self._windows = 0
+        self._lat_max = 0
+        for name, runs, missed, avg, late_max in self.sched.stats(reset=True):
+            print('sched', name, runs, 'runs', missed, 'missed',
+                avg, 'ms late avg', late_max, 'max')  #DEBUG
@@ -1,22 +1,157 @@
-from machine import Pin
+from machine import Pin, disable_irq, enable_irq
+from array import array
+import time
+import uasyncio as asyncio
+
+# Push button on a pin IRQ. The IRQ fires on both edges, debounces by time
+# and puts PRESS and RELEASE events in a small ring, so a press made while
+# the program is busy (e.g. a slow post) is not missed. An edge within
+# DEBOUNCE_MS of the last one taken is contact bounce and is ignored. If
+# the bounce ended on the other level, get() picks that up once the
+# debounce time has passed.
+#
+# LONG is given once when the button has been held LONG_MS, while it is
+# still held. It comes from get() rather than the IRQ as there is no edge
+# then. A press that turns into a long press still gives PRESS first.
+#
+# get() returns the next event or NONE without waiting. wait() and
+# wait_async() wait for one, or until a timeout. With ThreadSafeFlag
+# (uasyncio in MicroPython 1.15 on) the IRQ wakes wait_async() directly and
+# a task waiting for the button costs nothing between presses.
+
+NONE = 0
+PRESS = 1
+RELEASE = 2
+LONG = 3
+
+DEBOUNCE_MS = 30
+LONG_MS = 2000
+RING = 8            # events held; more than this and the newest are lost
+POLL_MS = 100       # how often to look without ThreadSafeFlag
+
 
 class Button:
 
-    def __init__(self, pin, activelow=True):
+    def __init__(self, pin, activelow=True, debounce_ms=DEBOUNCE_MS, long_ms=LONG_MS):
         self.pin = pin
         self.activelow = activelow
-        self.state = self.pin.value()
+        self.debounce_ms = debounce_ms
+        self.long_ms = long_ms
+        self._ring = array('B', [NONE] * RING)
+        self._head = 0          # next slot to fill, written by the IRQ only
+        self._tail = 0          # next slot to read, written by get() only
+        self.lost = 0           # events dropped with the ring full
+        self._down = self.is_pressed()  # debounced state
+        self._t_edge = time.ticks_add(time.ticks_ms(), -debounce_ms)  # last edge taken
+        self._long = self._down         # LONG given for this press
+        try:
+            self._flag = asyncio.ThreadSafeFlag()
+        except AttributeError:
+            self._flag = None
+        self._cb = self._cb_edge        # bind once, not every edge
+        self.pin.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=self._cb)
 
-    def was_pressed(self):
-        # Returns True only on the transition of when the button was pressed
-        now = self.pin.value()
-        if self.state != now:
-            self.state = now
-            if self.activelow:
-                return now == 0
+    def _cb_edge(self, _):
+        # IRQ. No allocation: ints and the preallocated ring only.
+        now = time.ticks_ms()
+        if self._age(now) < self.debounce_ms:
+            return
+        down = self.pin.value() == (0 if self.activelow else 1)
+        if down == self._down:
+            return
+        self._down = down
+        self._t_edge = now
+        if down:
+            self._long = False
+        head = self._head
+        if head - self._tail >= RING:
+            self.lost += 1
+            return
+        self._ring[head % RING] = PRESS if down else RELEASE
+        self._head = head + 1
+        if self._flag is not None:
+            self._flag.set()
+
+    def _age(self, now):
+        # ms since the last edge taken. ticks_diff() goes negative once
+        # 2^29 ms (6.2 days) have passed, which is long ago as well.
+        d = time.ticks_diff(now, self._t_edge)
+        return d if d >= 0 else 0x20000000
+
+    def get(self):
+        # Returns the next event, or NONE
+        if self._tail == self._head:
+            now = time.ticks_ms()
+            if self._down != self.is_pressed():
+                # Bounce ended on the other level. Take it as an edge.
+                state = disable_irq()
+                self._cb_edge(None)
+                enable_irq(state)
+            elif self._down and not self._long and self._age(now) >= self.long_ms:
+                self._long = True
+                return LONG
+            if self._tail == self._head:
+                return NONE
+        ev = self._ring[self._tail % RING]
+        self._tail += 1
+        return ev
+
+    def _due_ms(self):
+        # ms until get() may have something with no edge: the debounce
+        # time running out or a long press. None if nothing is due.
+        if self._down != self.is_pressed():
+            ms = self.debounce_ms
+        elif self._down and not self._long:
+            ms = self.long_ms
+        else:
+            return None
+        return max(ms - self._age(time.ticks_ms()), 0)
+
+    def _wait_ms(self, t_end):
+        # ms to wait before looking again, at most until t_end
+        ms = self._due_ms()
+        if t_end is not None:
+            left = max(time.ticks_diff(t_end, time.ticks_ms()), 0)
+            ms = left if ms is None else min(ms, left)
+        return ms
+
+    def wait(self, timeout_ms=None):
+        # Block until an event, or NONE after timeout_ms
+        t_end = None if timeout_ms is None else time.ticks_add(time.ticks_ms(), timeout_ms)
+        while True:
+            ev = self.get()
+            if ev or (t_end is not None and time.ticks_diff(t_end, time.ticks_ms()) <= 0):
+                return ev
+            ms = self._wait_ms(t_end)
+            time.sleep_ms(POLL_MS if ms is None else min(ms, POLL_MS))
+
+    async def wait_async(self, timeout_ms=None):
+        # Same as wait() but awaitable, the other tasks run meanwhile
+        t_end = None if timeout_ms is None else time.ticks_add(time.ticks_ms(), timeout_ms)
+        while True:
+            ev = self.get()
+            if ev or (t_end is not None and time.ticks_diff(t_end, time.ticks_ms()) <= 0):
+                return ev
+            ms = self._wait_ms(t_end)
+            if self._flag is None:
+                await asyncio.sleep_ms(POLL_MS if ms is None else min(ms, POLL_MS))
+            elif ms is None:
+                await self._flag.wait()
             else:
-                return now == 1
-        return False
+                try:
+                    await asyncio.wait_for_ms(self._flag.wait(), ms)
+                except asyncio.TimeoutError:
+                    pass
+
+    def was_pressed(self):
+        # Returns True if the button was pressed since the last call. Other
+        # events are dropped.
+        pressed = False
+        ev = self.get()
+        while ev:
+            pressed = pressed or ev == PRESS
+            ev = self.get()
+        return pressed
 
     def is_pressed(self):
         # Returns the real-time state of the button
@@ -24,4 +159,3 @@ class Button:
             return self.pin.value() == 0
         else:
             return self.pin.value() == 1
-
@@ -0,0 +1,156 @@
+# Integer to ASCII into preallocated buffers. The readings are kept as
+# integers in milli-units (milligallons, millipsi, ...) so the once a
+# second loop does no float math, and they are written out here digit by
+# digit without making any str objects. Writes past the end of the buffer
+# are dropped. Each function returns the position after what it wrote.
+#
+# Template is a line of text with fields at fixed places, made once. Each
+# update rewrites just the field slots in place.
+
+_P10 = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000, 1000000000)
+
+
+def put_str(buf, pos, s):
+    # Copy bytes, or a str of ASCII
+    n = len(buf)
+    if isinstance(s, str):
+        for ch in s:
+            if pos < n:
+                buf[pos] = ord(ch)
+            pos += 1
+    else:
+        for b in s:
+            if pos < n:
+                buf[pos] = b
+            pos += 1
+    return pos
+
+
+def put_int(buf, pos, value, zeros=0):
+    # zeros is the least number of digits, padded with leading zeros
+    n = len(buf)
+    if value < 0:
+        if pos < n:
+            buf[pos] = 45       # '-'
+        pos += 1
+        value = -value
+    digits = 1
+    while digits < len(_P10) and value >= _P10[digits]:
+        digits += 1
+    if digits < zeros:
+        digits = zeros
+    pos += digits
+    i = pos
+    while digits:
+        i -= 1
+        if i < n:
+            buf[i] = 48 + value % 10
+        value //= 10
+        digits -= 1
+    return pos
+
+
+def put_fixed(buf, pos, value, frac=3, decimals=1):
+    # value has frac decimal places (3 for milli-units). Written rounded to
+    # decimals places, e.g. put_fixed(buf, 0, 12345, 3, 1) writes 12.3
+    neg = value < 0
+    if neg:
+        value = -value
+    drop = frac - decimals
+    if drop > 0:
+        value = (value + _P10[drop] // 2) // _P10[drop]
+    elif drop < 0:
+        value *= _P10[-drop]
+    if neg and value:
+        if pos < len(buf):
+            buf[pos] = 45       # '-'
+        pos += 1
+    if not decimals:
+        return put_int(buf, pos, value)
+    pos = put_int(buf, pos, value // _P10[decimals])
+    if pos < len(buf):
+        buf[pos] = 46           # '.'
+    pos += 1
+    value %= _P10[decimals]
+    for i in range(decimals - 1, -1, -1):
+        if pos < len(buf):
+            buf[pos] = 48 + value // _P10[i] % 10
+        pos += 1
+    return pos
+
+
+def put_float(buf, pos, value, decimals=1):
+    # Write a float rounded to decimals places
+    return put_fixed(buf, pos, round(value * _P10[decimals]), decimals, decimals)
+
+
+def pad(buf, pos, end=None):
+    # Fill with spaces up to end (default the end of the buffer)
+    if end is None or end > len(buf):
+        end = len(buf)
+    while pos < end:
+        buf[pos] = 32
+        pos += 1
+    return pos
+
+
+def put_time(buf, pos, tm):
+    # Write a time.localtime() tuple as 2026-10-18T08:00:00Z
+    pos = put_int(buf, pos, tm[0], 4)
+    for i in range(1, 6):
+        if pos < len(buf):
+            buf[pos] = b'--T::'[i - 1]
+        pos = put_int(buf, pos + 1, tm[i], 2)
+    return put_str(buf, pos, b'Z')
+
+
+class Template:
+    # A line like 'g:{6.2} sts:{3}'. In braces:
+    #   {w}     -- w chars for an int or text
+    #   {w.d}   -- w chars for a value in frac-digit fixed point (milli-units
+    #              by default), shown with d decimals
+    #   {w.d:u} -- the same followed by the text u, e.g. a unit
+    # Fields are numbered from 0 in order. set() writes a value left aligned
+    # and padded with spaces into its slot of buf. Values too long for the
+    # slot are cut off.
+    def __init__(self, text, frac=3):
+        self.frac = frac
+        line = ''
+        slots = []
+        self._decs = []
+        self._units = []
+        while '{' in text:
+            i = text.index('{')
+            j = text.index('}', i)
+            line += text[:i]
+            spec = text[i + 1:j]
+            text = text[j + 1:]
+            unit = b''
+            if ':' in spec:
+                spec, unit = spec.split(':')
+                unit = unit.encode()
+            dec = None
+            if '.' in spec:
+                spec, dec = spec.split('.')
+                dec = int(dec)
+            width = int(spec)
+            slots.append((len(line), width))
+            self._decs.append(dec)
+            self._units.append(unit)
+            line += ' ' * width
+        line += text
+        self.buf = bytearray(line.encode())
+        mv = memoryview(self.buf)
+        self._slots = [mv[i:i + w] for i, w in slots]
+
+    def set(self, field, value):
+        slot = self._slots[field]
+        dec = self._decs[field]
+        if dec is not None:
+            pos = put_fixed(slot, 0, value, self.frac, dec)
+        elif isinstance(value, int):
+            pos = put_int(slot, 0, value)
+        else:
+            pos = put_str(slot, 0, value)
+        pos = put_str(slot, pos, self._units[field])
+        pad(slot, pos)
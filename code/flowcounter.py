@@ -1,4 +1,6 @@
-from machine import Pin, Timer
+from machine import Pin, Timer, disable_irq, enable_irq
+from array import array
+import time
 
 # Pulses per liter -- Filled up a 5 gallon bucket with hose at full on
 # and got 8661 pulses. Maybe took 20 seconds.
@@ -19,39 +21,220 @@ from machine import Pin, Timer
 
 CONV_L_TO_GAL = 1/3.7854    # Liter to gallon conversion ratio
 
+# Integer versions for the once a second readings: volume in milligallons
+# and flow in milligallons per minute. mgal/min = uL per pulse * MGPM_K //
+# us per pulse, which stays a small int for any LUT entry.
+UL_PER_MGAL = 3785
+MGPM_K = 60000000 // UL_PER_MGAL
+
+# Flow rate. The IRQ keeps the ticks_us() of the last N_TIMES pulses and
+# rate() works out the pulse frequency from the oldest to the newest. At the
+# sensor's 2 L/min minimum (~16 Hz) that is about the last second.
+N_TIMES = 16
+RATE_TIMEOUT_US = 2000000   # no pulse for this long means no flow
+
+# Glitch filter. An edge sooner than MIN_PULSE_US after the last counted
+# pulse is noise (e.g. from the pump motor) and is only counted in
+# glitches. The IRQ is a hard one so ticks_us() is the time of the edge.
+# A soft IRQ is queued while the VM is busy (an LCD write, a flash write,
+# GC) and then runs the held pulses back to back, which the filter would
+# throw away as glitches. 200 us passes up to 5 kHz, twice the sensor's 2.5 kHz max.
+MIN_PULSE_US = 200
+
+# Calibration. Pulses per liter depends on flow rate, so the curve of
+# (pulse Hz, pulses per liter) points from config.json is made into a
+# table at start up: microliters per pulse for every LUT_STEP_HZ of pulse
+# frequency, linear between the points and flat past the ends. update()
+# looks up the pulses since the last call at their frequency and adds
+# them up in microliters, integers only. Without a curve it is RATIO_PPL
+# at every frequency.
+RATIO_PPL = 468         # pulses per liter, bucket test above
+LUT_SHIFT = 3           # LUT_STEP_HZ = 8
+LUT_SIZE = 320          # up to 2560 Hz
+
+
+def make_lut(cal=None):
+    # Table of microliters per pulse for each LUT step of pulse frequency,
+    # from a list of (Hz, pulses per liter) points
+    if not cal:
+        cal = ((0, RATIO_PPL),)
+    cal = sorted(cal)
+    lut = array('H', [0] * LUT_SIZE)
+    j = 0
+    for i in range(LUT_SIZE):
+        hz = (i << LUT_SHIFT) + (1 << LUT_SHIFT) // 2   # middle of the step
+        while j < len(cal) - 1 and cal[j + 1][0] <= hz:
+            j += 1
+        hz0, ppl = cal[j]
+        if j < len(cal) - 1 and hz > hz0:
+            hz1, ppl1 = cal[j + 1]
+            ppl += (ppl1 - ppl) * (hz - hz0) / (hz1 - hz0)
+        lut[i] = min(int(1000000 / ppl + 0.5), 0xFFFF)
+    return lut
+
+
+# Pulse counts are double buffered so the main loop can take a consistent
+# count and start a new period: the IRQ only ever adds to the active bank.
+# snapshot_and_reset() switches the active bank, then reads and clears the
+# old one, which the IRQ no longer touches. A hard IRQ can land in the
+# middle of a bytecode, so the switch and the read are done with IRQs off
+# for those few instructions. A pulse lands wholly in one bank or the
+# other. No pulse is lost or counted twice. (sim_flowcounter.py checks
+# this on a PC.)
+
 
 class FlowCount:
-    def __init__(self, pin):
+    def __init__(self, pin, min_us=MIN_PULSE_US, cal=None):
         self.pin = pin
-        self.ctr_pulses = 0     # raw pulse count
-        self.ratio_ppl = 468    # pulses per liter of liquid
-        self.acc_liters = 0     # liters accumulated
-        self.ctr_reset = False  # flag for IRQ to reset count
 
-        # Interrupt callback for every pin pulse detected
-        self.pin.irq(trigger=Pin.IRQ_FALLING, handler=self._cb_pulse)
+        # Calibration table, and the volume so far this period
+        self.lut = make_lut(cal)
+        self._acc = 0           # microliters added up by update()
+        self._seen = 0          # pulses of this period already in _acc
+        self._upp = self.lut[0] # microliters per pulse at the last update
+        self._upd_ms = time.ticks_ms()
+
+        # Glitch filter. 0 turns it off. glitches is the total rejected.
+        self.min_us = min_us
+        self.glitches = 0
+        self._last = time.ticks_us()
+
+        # Pulse count banks, and which one the IRQ adds to
+        self._cnt = array('L', [0, 0])
+        self._bank = 0
+
+        # Ring buffer of pulse times for rate()
+        self._times = array('L', [0] * N_TIMES)
+        self._ti = 0            # next slot to fill
+        self._tn = 0            # slots filled
+        self._period_ms = time.ticks_ms()   # start of period, for average rate
+
+        # Interrupt callback for every pin pulse detected. Hard, so it runs
+        # at the edge and must not allocate.
+        self.pin.irq(trigger=Pin.IRQ_FALLING, handler=self._cb_pulse, hard=True)
 
     def __del__(self):
         del self.pin
 
     def _cb_pulse(self, _):
         # Call this every pulse detected. IRQ must use integer only!
-        self.ctr_pulses += 1
-        if self.ctr_reset:
-            self.ctr_reset = False
-            self.acc_liters = 0
-            self.ctr_pulses = 0
-        elif self.ctr_pulses >= self.ratio_ppl:
-            self.ctr_pulses = 0
-            self.acc_liters += 1
+        # The diff goes negative after a long idle (ticks_us() wraps), so
+        # only 0 up to min_us is a glitch.
+        t = time.ticks_us()
+        if 0 <= time.ticks_diff(t, self._last) < self.min_us:
+            self.glitches += 1
+            return
+        self._last = t
+
+        i = self._ti
+        self._times[i] = t
+        i += 1
+        if i == N_TIMES:
+            i = 0
+        self._ti = i
+        if self._tn < N_TIMES:
+            self._tn += 1
+
+        self._cnt[self._bank] += 1
+
+    def pulses(self):
+        # Pulses so far in this period
+        return self._cnt[self._bank]
+
+    def _lookup(self, hz):
+        # Microliters per pulse at a pulse frequency
+        i = hz >> LUT_SHIFT
+        return self.lut[i if i < LUT_SIZE else LUT_SIZE - 1]
+
+    def _add(self, n, now):
+        # Add n pulses since the last update to the volume at the
+        # frequency they came in
+        dt = time.ticks_diff(now, self._upd_ms)
+        self._upd_ms = now
+        if n:
+            if dt > 0:
+                self._upp = self._lookup(n * 1000 // dt)
+            self._acc += n * self._upp
+
+    def update(self):
+        # Call every second or so to apply the calibration over short
+        # intervals
+        pulses = self._cnt[self._bank]
+        self._add(pulses - self._seen, time.ticks_ms())
+        self._seen = pulses
+
+    def snapshot_and_reset(self):
+        # Ends the period and starts a new one. Returns (pulses, liters,
+        # interval in ms) of the period that ended.
+        now = time.ticks_ms()
+        irq = disable_irq()
+        old = self._bank
+        self._bank = old ^ 1        # IRQ now counts in the other bank
+        pulses = self._cnt[old]
+        self._cnt[old] = 0
+        enable_irq(irq)
+        self._add(pulses - self._seen, now)
+        self._seen = 0
+        ul = self._acc
+        self._acc = 0
+        interval = time.ticks_diff(now, self._period_ms)
+        self._period_ms = now
+        return pulses, ul / 1000000, interval
 
     def volume(self, reset=False):
-        liters = self.acc_liters + self.ctr_pulses / self.ratio_ppl
         if reset:
-            self.ctr_reset = True
-            self.acc_liters = 0
-            self.ctr_pulses = 0
-        return liters
+            return self.snapshot_and_reset()[1]
+        # Pulses since the last update() go at the last update's frequency
+        return (self._acc + (self.pulses() - self._seen) * self._upp) / 1000000
+
+    def volume_mgal(self):
+        # Volume so far this period in milligallons, integer math only
+        return (self._acc + (self.pulses() - self._seen) * self._upp) // UL_PER_MGAL
+
+    def _pulse_us(self):
+        # Average microseconds between the last N_TIMES pulses. 0 if there
+        # are not enough, or no flow.
+        irq = disable_irq()
+        n = self._tn
+        i = self._ti
+        newest = self._times[i - 1]
+        oldest = self._times[i - n if i >= n else i - n + N_TIMES]
+        idle = time.ticks_diff(time.ticks_us(), newest)
+        if n and not 0 <= idle < RATE_TIMEOUT_US:
+            # Stopped. Forget old pulses, ticks_us() wraps every 18 min.
+            self._tn = 0
+            n = 0
+        enable_irq(irq)
+        if n < 2:
+            return 0
+        span = time.ticks_diff(newest, oldest)
+        return span // (n - 1) if span > 0 else 0
+
+    def rate_mgpm(self):
+        # Instantaneous flow in milligallons per minute, integer math only
+        us = self._pulse_us()
+        if not us:
+            return 0
+        return self._lookup(1000000 // us) * MGPM_K // us
+
+    def rate(self):
+        # Returns flow in liters per minute: (instantaneous, average since
+        # the last reset). Instantaneous is over the last N_TIMES pulses.
+        us = self._pulse_us()
+        inst = 0.0
+        if us:
+            inst = self._lookup(1000000 // us) * 60 / us
+
+        elapsed = time.ticks_diff(time.ticks_ms(), self._period_ms)
+        avg = 0.0
+        if elapsed > 0:
+            avg = self.volume() * 60000 / elapsed
+        return inst, avg
+
+    def rate_gpm(self):
+        # Same as rate() in gallons per minute
+        inst, avg = self.rate()
+        return inst * CONV_L_TO_GAL, avg * CONV_L_TO_GAL
 
     def volume_gal(self, reset=False):
         gal = self.volume(reset=reset) * CONV_L_TO_GAL
@@ -0,0 +1,252 @@
+try:
+    import ustruct as struct
+except:
+    import struct
+import time
+import machine
+import uasyncio as asyncio
+import app
+import wifi
+import ntptime
+import pressure
+import sampleq
+import thingspeak
+
+# Deep sleep cycle for pressure and temperature only deployments (no flow
+# counting, no display). Each wake takes one sample and goes back to sleep.
+# Once post_batch samples are waiting the radio comes on for that wake and
+# they are posted.
+#
+# Everything that has to last from one wake to the next is kept in RTC
+# memory, which survives deep sleep (not power off): counters, the clock
+# offset, wake to post times and the samples not yet posted. If posting
+# keeps failing and RTC memory fills up, the samples move to the queue file
+# on flash and are posted from there first.
+#
+# The ESP8266 wakes from deep sleep by GPIO16 pulling RST low, so GPIO16
+# must be wired to RST. On the Heltec board GPIO16 is also the OLED reset,
+# so leave the OLED out. Wakes that won't post start with the radio off.
+#
+# sim_lowpower.py runs the cycle on a PC to check nothing is lost.
+
+RTC_MAGIC = 0x4D46
+# magic, pending samples, samples on flash, wakes, samples, posts, failed
+# uploads, clock offset, last and max wake to post ms
+HDR_FMT = '<HHIIIIIiII'
+HDR_SIZE = struct.calcsize(HDR_FMT)
+REC_FMT = '<I%df' % sampleq.FIELDS     # timestamp, fields
+REC_SIZE = struct.calcsize(REC_FMT)
+RTC_MEM = 492               # bytes of RTC user memory on the ESP8266
+RTC_SLOTS = (RTC_MEM - HDR_SIZE) // REC_SIZE
+NO_CLOCK = -0x80000000      # clock offset not known yet
+
+WIFI_TIMEOUT_MS = 15000     # give up connecting after N ms
+POLL_MS = 50                # light sleep between checks while awake
+RF_ON = 0                   # esp.deepsleep() options for the next wake
+RF_OFF = 4
+
+
+def sleep_light(ms):
+    # Idle the CPU for ms. Pin IRQs still come in. Soft Timer callbacks
+    # (all Timers on the ESP8266) wait until it's over.
+    try:
+        machine.lightsleep(ms)
+    except AttributeError:
+        time.sleep_ms(ms)
+
+
+def sleep_deep(ms, radio=True):
+    # Sleep until reset by GPIO16 after ms. radio=False wakes with the
+    # radio off, which saves its calibration.
+    try:
+        import esp
+        esp.deepsleep(ms * 1000, RF_ON if radio else RF_OFF)
+    except ImportError:
+        machine.deepsleep(ms)
+
+
+class RtcState:
+    # The state kept in RTC memory over deep sleep
+
+    def __init__(self, rtc=None):
+        self.rtc = machine.RTC() if rtc is None else rtc
+        self.valid = self.load()
+
+    def load(self):
+        # Returns False (and a fresh state) if RTC memory holds none, as
+        # after power on
+        self.pending = []       # (ts, field1, ...) oldest first
+        self.flash = 0
+        self.wakes = 0
+        self.samples = 0
+        self.posts = 0
+        self.fails = 0
+        self.clock_offset = None
+        self.lat_last = 0
+        self.lat_max = 0
+        data = self.rtc.memory()
+        if len(data) < HDR_SIZE:
+            return False
+        hdr = struct.unpack_from(HDR_FMT, data)
+        if hdr[0] != RTC_MAGIC or len(data) < HDR_SIZE + hdr[1] * REC_SIZE:
+            return False
+        (_, n, self.flash, self.wakes, self.samples, self.posts, self.fails,
+            offset, self.lat_last, self.lat_max) = hdr
+        if offset != NO_CLOCK:
+            self.clock_offset = offset
+        for i in range(n):
+            self.pending.append(struct.unpack_from(REC_FMT, data, HDR_SIZE + i * REC_SIZE))
+        return True
+
+    def save(self):
+        n = len(self.pending)
+        buf = bytearray(HDR_SIZE + n * REC_SIZE)
+        struct.pack_into(HDR_FMT, buf, 0, RTC_MAGIC, n, self.flash, self.wakes,
+            self.samples, self.posts, self.fails,
+            NO_CLOCK if self.clock_offset is None else self.clock_offset,
+            self.lat_last, self.lat_max)
+        for i in range(n):
+            struct.pack_into(REC_FMT, buf, HDR_SIZE + i * REC_SIZE, *self.pending[i])
+        self.rtc.memory(buf)
+
+
+class DeepCycle:
+
+    def __init__(self, config, rtc=None):
+        self.config = config
+        self.state = RtcState(rtc)
+        self.queue = None           # flash queue, opened only when needed
+        if not self.state.valid:
+            # Power on. Pick up anything left on flash.
+            self.state.flash = len(self._flash_queue())
+
+        # Same posting as app.App
+        self.up = thingspeak.Uploader(config, app.FIELD_DEC)
+        self.batch = min(self.up.batch, RTC_SLOTS)
+
+    def run(self):
+        # One wake, then deep sleep until the next sample is due
+        t_wake = time.ticks_ms()
+        self.step()
+        awake = time.ticks_diff(time.ticks_ms(), t_wake)
+        sleep_deep(max(app.POST_RATE * 1000 - awake, 1000), self.backlog() + 1 >= self.batch)
+
+    def step(self):
+        # Take a sample, post if a batch is waiting, save the state
+        st = self.state
+        st.wakes += 1
+        ts = 0
+        if st.clock_offset is not None:
+            ts = time.time() + st.clock_offset
+        rec = (ts,) + tuple(self.sample())
+        st.samples += 1
+        if len(st.pending) >= RTC_SLOTS:
+            self._spill()
+        st.pending.append(rec)
+        if self.backlog() >= self.batch:
+            self.upload()
+        st.save()
+
+    def sample(self):
+        # Returns the Thingspeak fields. No flow sensor here, so volume and
+        # glitches are 0.
+        press = pressure.Pressure(rate_hz=0)
+        bus = app.make_therm(self.config)
+        bus.start_conv()
+        while not bus.ready():
+            sleep_light(POLL_MS)
+        psi = press.read_psi(clip=True)
+        return (0.0, psi, bus.temp_F(app.TEMP_SENSOR), psi, psi, psi, 0)
+
+    def _flash_queue(self):
+        if self.queue is None:
+            self.queue = sampleq.SampleQueue(app.QUEUE_FILE, app.QUEUE_SLOTS)
+        return self.queue
+
+    def _spill(self):
+        # RTC memory is full. Move the pending samples to flash.
+        q = self._flash_queue()
+        for rec in self.state.pending:
+            q.put(rec[0], rec[1:])
+        self.state.flash = len(q)
+        self.state.pending = []
+
+    def backlog(self):
+        # Samples waiting to be posted
+        return self.state.flash + len(self.state.pending)
+
+    def peek(self, i):
+        # The i-th oldest waiting sample, flash first. None if there are not
+        # that many.
+        st = self.state
+        if i < st.flash:
+            return self._flash_queue().peek(i)
+        if i - st.flash < len(st.pending):
+            return st.pending[i - st.flash]
+        return None
+
+    def drop(self, n):
+        # Remove the n oldest waiting samples
+        st = self.state
+        if st.flash:
+            k = min(n, st.flash)
+            q = self._flash_queue()
+            q.drop(k)
+            st.flash = len(q)
+            n -= k
+        st.pending = st.pending[n:]
+
+    def upload(self):
+        # Connect and post everything waiting. Records the time from wake
+        # (reset, so ticks_ms()) to the first post that went through.
+        st = self.state
+        if not self.connect():
+            st.fails += 1
+            return
+        self.wi.resolve_url(thingspeak.URL_POST)
+        if st.clock_offset is None:
+            try:
+                st.clock_offset = ntptime.time() - time.time()
+            except (OSError, IndexError, ValueError):
+                pass
+        asyncio.run(self._drain())
+        self.wi.radio(False)
+
+    async def _drain(self):
+        # Post oldest first, stop at the first failure. Like App._upload()
+        # but with nothing else to run meanwhile.
+        st = self.state
+        first = True
+        while self.backlog():
+            n = self.up.count(self.peek)
+            sts = await self.post(n)
+            print(sts, n, self.backlog())   #DEBUG
+            if sts != 'ook':
+                st.fails += 1
+                break
+            self.drop(n)
+            st.posts += 1
+            if first:
+                first = False
+                st.lat_last = time.ticks_ms()
+                st.lat_max = max(st.lat_max, st.lat_last)
+            if self.backlog():
+                await asyncio.sleep(app.DRAIN_GAP)
+        if self.queue is not None:
+            self.queue.save()
+        await self.wi.http_close()
+
+    def connect(self):
+        # Returns True once connected, False after WIFI_TIMEOUT_MS
+        self.wi = wifi.WIFI(self.config['hostname'])
+        t = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), t) < WIFI_TIMEOUT_MS:
+            if self.wi.check(self.config['ssid'], self.config['pwd']) == 'con':
+                return True
+            sleep_light(POLL_MS)
+        self.wi.radio(False)
+        return False
+
+    async def post(self, n):
+        # Post the n oldest waiting samples
+        return await self.up.post(self.wi, self.peek, n)
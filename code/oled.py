@@ -1,5 +1,5 @@
 import machine, ssd1306
-from machine import Pin
+from machine import Pin, I2C
 from time import time, sleep
 
 # Heltek 8 (ESP8266) hardwired pin assignments
@@ -15,6 +15,7 @@ LINE_HEIGHT = 12        # N pixels tall each line
 LINE_CHARS = 16         # N chars for each line
 LINE_LINES = 3          # N lines of text
 CHAR_WIDTH = 8
+DISP_PAGES = DISP_HEIGHT // 8   # display RAM is in pages of 8 pixel rows
 
 class OLED:
 
@@ -27,21 +28,69 @@ class OLED:
 
         # OLED is 128 pixels wide x 32 pixels tall, I2C interface
         self.i2c = I2C(scl=Pin(PIN_SCL), sda=Pin(PIN_SDA), freq=I2C_FREQ)
-        self.oled = ssd1306.SSD1306_I2C(DISP_WIDTH, DISP_HEIGHT, self.i2c)
-        self.oled.fill(0) 
-        self.oled.show()
+        self.oled = ssd1306.SSD1306_I2C(DISP_WIDTH, DISP_HEIGHT, self.i2c)   # starts out cleared
         self.visible = True
 
+        # Copy of what was last sent to the display, and for each page the
+        # range of columns drawn on since (lo > hi means nothing to send)
+        self._shadow = bytearray(DISP_WIDTH * DISP_PAGES)
+        self._dirty_lo = bytearray(DISP_PAGES)
+        self._dirty_hi = bytearray(DISP_PAGES)
+        for page in range(DISP_PAGES):
+            self._dirty_lo[page] = 0xFF
+
+    def _mark(self, x, y, w, h):
+        # Mark a rectangle in pixels as needing to be sent
+        x1 = min(x + w, DISP_WIDTH) - 1
+        y1 = min(y + h, DISP_HEIGHT) - 1
+        if x > x1 or y > y1:
+            return
+        for page in range(y // 8, y1 // 8 + 1):
+            if x < self._dirty_lo[page]:
+                self._dirty_lo[page] = x
+            if x1 > self._dirty_hi[page]:
+                self._dirty_hi[page] = x1
+
     def clear(self):
+        # Takes effect on commit()
         self.oled.fill(0) 
-        self.oled.show()
+        self._mark(0, 0, DISP_WIDTH, DISP_HEIGHT)
 
     def text(self, text='', row=0, col=0):
+        # Takes effect on commit(). text is a str, or a bytearray of
+        # character codes (drawn a character at a time, which makes no
+        # new str objects).
         width = len(text)
         # Erase the line (fill the rectangle with 0)
         self.oled.fill_rect(col*CHAR_WIDTH, row*LINE_HEIGHT, width*CHAR_WIDTH, LINE_HEIGHT, 0)
-        self.oled.text(text, col*CHAR_WIDTH, row*LINE_HEIGHT)
-        self.oled.show()
+        if isinstance(text, str):
+            self.oled.text(text, col*CHAR_WIDTH, row*LINE_HEIGHT)
+        else:
+            for k in range(width):
+                self.oled.text(chr(text[k]), (col + k)*CHAR_WIDTH, row*LINE_HEIGHT)
+        self._mark(col*CHAR_WIDTH, row*LINE_HEIGHT, width*CHAR_WIDTH, LINE_HEIGHT)
+
+    def commit(self):
+        # Send what changed since the last commit. Each dirty page is
+        # trimmed to the columns that really differ from the shadow copy,
+        # so redrawing the same text sends nothing.
+        fb = self.oled.fbuf
+        shadow = self._shadow
+        for page in range(DISP_PAGES):
+            c0 = self._dirty_lo[page]
+            c1 = self._dirty_hi[page]
+            self._dirty_lo[page] = 0xFF
+            self._dirty_hi[page] = 0
+            base = page * DISP_WIDTH
+            while c0 <= c1 and fb[base + c0] == shadow[base + c0]:
+                c0 += 1
+            while c1 >= c0 and fb[base + c1] == shadow[base + c1]:
+                c1 -= 1
+            if c0 > c1:
+                continue
+            self.oled.show(c0, c1, page, page)
+            for i in range(base + c0, base + c1 + 1):
+                shadow[i] = fb[i]
 
     def blank(self, blnk):
         if blnk:
@@ -1,4 +1,6 @@
-from machine import Pin, ADC
+from machine import Pin, ADC, Timer, disable_irq, enable_irq
+from array import array
+import time
 
 # OTUAYAUTO 100 Psi Pressure Transducer Sender Sensor
 #   1/8" -27 NPT 27 NPT Thread Stainless for Oil Fuel Air Water Pressure with Harness
@@ -13,15 +15,205 @@ CAL_MAX_V = 4.5
 ADC_VREF = 3.3
 DEC_PLACES = 1
 
+# Background sampling. The ADC is noisy so a Timer fills a ring buffer and
+# read_psi() returns the median (or mean) of it. Don't go much faster: on
+# the ESP8266 reading the ADC very often upsets WiFi.
+SAMPLE_HZ = 50          # ADC samples per second, 0 = read on demand only
+N_SAMPLES = 32          # samples in ring buffer (0.64 s at 50 Hz)
+
+# Every background sample also goes into the period stats (min, max, mean,
+# count; see period_stats()) and is checked against the transient triggers.
+# When one fires, PRE samples before it and POST samples after it are kept
+# for capture(). The sum is of samples >> SUM_SHIFT so it stays a small int
+# (no heap use in the callback) for SUM_MAX_COUNT samples, 87 min at 50 Hz.
+PRE = 16                # samples kept from before a trigger (<= nsamples)
+POST = 48               # samples kept from after a trigger
+SUM_SHIFT = 4
+SUM_MAX_COUNT = 262000
+
+# read_mpsi() works in integers: millipsi = (raw * k >> MPSI_SHIFT) + offset,
+# with k and offset worked out once from the calibration. The shift keeps
+# raw * k a small int.
+MPSI_SHIFT = 13
+
 class Pressure:
-    def __init__(self):
+    def __init__(self, rate_hz=SAMPLE_HZ, nsamples=N_SAMPLES, median=True,
+                 trig_hi=None, trig_lo=None, trig_slope=None, pre=PRE, post=POST):
+        # Triggers are in psi, trig_slope in psi per sample. None = off.
         self.adc = ADC(0)
         # y = mx+b; m = slope; b = y-mx
         self.slope = (CAL_MAX_P - CAL_MIN_P) / (CAL_MAX_V - CAL_MIN_V)   # psi/V = 25spi/V
         self.offset = CAL_MAX_P - self.slope*CAL_MAX_V                   # -12.5 psi
+        self._mk = int(self.slope * ADC_VREF * 1000 * (1 << MPSI_SHIFT) / 65535 + 0.5)
+        self._moff = int(self.offset * 1000)
+        self._mmin = int(CAL_MIN_P * 1000)
+        self._mmax = int(CAL_MAX_P * 1000)
+        self.rate_hz = rate_hz
+
+        # Period stats, raw ADC units
+        self._smin = 65535
+        self._smax = 0
+        self._ssum = 0
+        self._scnt = 0
+
+        # Transient triggers, converted to raw ADC units. Out of range
+        # values never fire. trig_hi and trig_lo fire on crossing the
+        # level, not on being past it, so a pressure that stays high or low
+        # (e.g. 0 psi all night with the pump off) captures once.
+        self._trig_hi = 65536 if trig_hi is None else self._to_raw(trig_hi)
+        self._trig_lo = -1 if trig_lo is None else self._to_raw(trig_lo)
+        self._trig_slope = 65536 if trig_slope is None else \
+            int(trig_slope / self.slope / ADC_VREF * 65535)
+        self._pre = min(pre, nsamples)
+        self._cap = array('H', [0] * (self._pre + post))
+        self._cap_i = 0         # next slot to fill in _cap
+        self._cap_ticks = 0     # time.ticks_ms() of trigger
+        self._cap_pre = 0       # samples in _cap from before the trigger
+        self._cap_state = 0     # 0 = armed, 1 = filling, 2 = ready
+        self._last = -1         # previous sample, for the slope trigger
+
+        # Ring buffer of raw samples, and scratch space for the median
+        self.median = median
+        self._buf = array('H', [0] * nsamples)
+        self._tmp = array('H', [0] * nsamples)
+        self._i = 0             # next slot to fill
+        self._n = 0             # slots filled so far
+        self.timer = None
+        if rate_hz:
+            self._cb = self._cb_sample      # bind once, not every tick
+            self.timer = Timer(-1)
+            self.timer.init(period=1000 // rate_hz, mode=Timer.PERIODIC, callback=self._cb)
+
+    def stop(self):
+        # Stop background sampling
+        if self.timer:
+            self.timer.deinit()
+            self.timer = None
+
+    def _to_raw(self, psi):
+        # psi to ADC reading, the inverse of read_psi()
+        return int((psi - self.offset) / self.slope / ADC_VREF * 65535)
+
+    def _to_psi(self, raw):
+        return self.slope * (raw / 65535 * ADC_VREF) + self.offset
+
+    def _cb_sample(self, _):
+        # Timer callback. Integer only, no allocation.
+        v = self.adc.read_u16()
+        i = self._i
+        self._buf[i] = v
+        i += 1
+        if i == len(self._buf):
+            i = 0
+        self._i = i
+        if self._n < len(self._buf):
+            self._n += 1
+
+        # Period stats
+        if v < self._smin:
+            self._smin = v
+        if v > self._smax:
+            self._smax = v
+        if self._scnt < SUM_MAX_COUNT:
+            self._ssum += v >> SUM_SHIFT
+            self._scnt += 1
+
+        # Transient capture
+        last = self._last
+        self._last = v
+        state = self._cap_state
+        if state == 1:
+            self._cap[self._cap_i] = v
+            self._cap_i += 1
+            if self._cap_i == len(self._cap):
+                self._cap_state = 2
+        elif state == 0 and last >= 0 and (
+                (v > self._trig_hi and last <= self._trig_hi) or
+                (v < self._trig_lo and last >= self._trig_lo) or
+                v - last > self._trig_slope or last - v > self._trig_slope):
+            # Copy the samples up to and including this one from the ring
+            pre = self._pre
+            if pre > self._n:
+                pre = self._n
+            k = i - pre
+            if k < 0:
+                k += len(self._buf)
+            for j in range(pre):
+                self._cap[j] = self._buf[k]
+                k += 1
+                if k == len(self._buf):
+                    k = 0
+            self._cap_i = pre
+            self._cap_pre = pre
+            self._cap_ticks = time.ticks_ms()
+            self._cap_state = 1 if pre < len(self._cap) else 2
+
+    def period_stats(self, reset=True):
+        # Returns (min, max, mean) psi and the number of samples since the
+        # last reset. All None and 0 if there were no samples.
+        irq = disable_irq()
+        smin = self._smin
+        smax = self._smax
+        ssum = self._ssum
+        scnt = self._scnt
+        if reset:
+            self._smin = 65535
+            self._smax = 0
+            self._ssum = 0
+            self._scnt = 0
+        enable_irq(irq)
+        if scnt == 0:
+            return None, None, None, 0
+        mean = (ssum << SUM_SHIFT) / scnt
+        return (round(self._to_psi(smin), DEC_PLACES), round(self._to_psi(smax), DEC_PLACES),
+            round(self._to_psi(mean), DEC_PLACES), scnt)
+
+    def capture(self):
+        # Returns (ticks_ms of trigger, number of samples before it, raw
+        # samples) once a transient capture is complete, else None. Call
+        # rearm() when done with the samples.
+        if self._cap_state != 2:
+            return None
+        return self._cap_ticks, self._cap_pre, self._cap
+
+    def capturing(self):
+        # True while a triggered capture is still taking samples
+        return self._cap_state == 1
+
+    def capture_psi(self, raw):
+        # Converts a captured raw sample to psi
+        return round(self._to_psi(raw), DEC_PLACES)
+
+    def rearm(self):
+        # Allow the next trigger to capture
+        self._cap_state = 0
+
+    def read_raw(self):
+        # Filtered ADC reading, 0 to 65535. Uses only preallocated buffers.
+        n = self._n
+        if n == 0:
+            return self.adc.read_u16()
+        buf = self._buf
+        if not self.median:
+            total = 0
+            for k in range(n):
+                total += buf[k]
+            return total // n
+
+        # Insertion sort into the scratch buffer. Takes a copy as it goes
+        # so the timer writing buf meanwhile does no harm.
+        tmp = self._tmp
+        for k in range(n):
+            v = buf[k]
+            j = k
+            while j > 0 and tmp[j - 1] > v:
+                tmp[j] = tmp[j - 1]
+                j -= 1
+            tmp[j] = v
+        return tmp[n // 2]
 
     def read_psi(self, clip=False):
-        vadc= self.adc.read_u16() / 65535 * ADC_VREF
+        vadc= self.read_raw() / 65535 * ADC_VREF
         
         # y = mx + b
         psi = self.slope * vadc + self.offset
@@ -31,3 +223,13 @@ class Pressure:
             elif psi > CAL_MAX_P:
                 psi = CAL_MAX_P
         return round(psi, DEC_PLACES)
+
+    def read_mpsi(self, clip=False):
+        # Same as read_psi() in millipsi, integer math only
+        mpsi = (self.read_raw() * self._mk >> MPSI_SHIFT) + self._moff
+        if clip:
+            if mpsi < self._mmin:
+                mpsi = self._mmin
+            elif mpsi > self._mmax:
+                mpsi = self._mmax
+        return mpsi
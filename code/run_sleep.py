@@ -0,0 +1,11 @@
+import ujson
+import lowpower
+
+# Deep sleep front end for pressure and temperature only: no display and no
+# flow sensor. See lowpower.py. GPIO16 must be wired to RST.
+
+# Read in config file
+with open('config.json', 'r') as f:
+    config = ujson.loads(f.read())
+
+lowpower.DeepCycle(config).run()
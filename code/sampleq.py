@@ -0,0 +1,103 @@
+try:
+    import ustruct as struct
+except:
+    import struct
+import os
+
+# Store-and-forward queue of samples on flash. Survives reboots so samples
+# taken while the hotspot is down get posted later, oldest first.
+#
+# The data file is preallocated to a fixed number of slots, one fixed size
+# record each, and written as a ring: record with sequence number n goes in
+# slot n % slots. Every write goes to the next slot in turn so flash wear
+# is spread over the whole file. The head (next sequence number) is found
+# at boot by scanning the slots. The tail (oldest unsent) is kept in a
+# separate 4 byte ack file that is written only by save(), once per drain.
+#
+# Record: seq, timestamp (0 = unknown), then the Thingspeak fields 1 to
+# FIELDS in order.
+
+FIELDS = 7
+REC_FMT = '<II%df' % FIELDS
+REC_SIZE = struct.calcsize(REC_FMT)
+EMPTY = 0xFFFFFFFF      # seq of an erased slot
+
+
+class SampleQueue:
+    def __init__(self, fname, slots=256):
+        self.fname = fname
+        self.ackname = fname + '.ack'
+        self.slots = slots
+        self._rec = bytearray(REC_SIZE)     # reused for every read and write
+        self._ack = bytearray(4)
+        try:
+            if os.stat(fname)[6] != slots * REC_SIZE:
+                raise OSError
+            self.f = open(fname, 'r+b')
+        except OSError:
+            self._create()
+        self._scan()
+
+    def _create(self):
+        # Preallocate the data file with erased slots and start from zero
+        for i in range(REC_SIZE):
+            self._rec[i] = 0xFF
+        with open(self.fname, 'wb') as f:
+            for _ in range(self.slots):
+                f.write(self._rec)
+        self.f = open(self.fname, 'r+b')
+        self.tail = 0
+        self.save()
+
+    def _scan(self):
+        # Find the newest record. Tail is from the ack file, but never more
+        # than a full ring behind the head.
+        head = 0
+        for slot in range(self.slots):
+            self.f.seek(slot * REC_SIZE)
+            self.f.readinto(self._rec)
+            seq = struct.unpack_from('<I', self._rec)[0]
+            if seq != EMPTY and seq % self.slots == slot and seq >= head:
+                head = seq + 1
+        try:
+            with open(self.ackname, 'rb') as f:
+                f.readinto(self._ack)
+            tail = struct.unpack_from('<I', self._ack)[0]
+        except OSError:
+            tail = 0
+        self.head = head
+        self.tail = min(max(tail, head - self.slots), head)
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def put(self, ts, fields):
+        # Append a sample, FIELDS values. If the queue is full the oldest
+        # one is lost.
+        seq = self.head
+        struct.pack_into(REC_FMT, self._rec, 0, seq, ts, *fields)
+        self.f.seek((seq % self.slots) * REC_SIZE)
+        self.f.write(self._rec)
+        self.f.flush()
+        self.head = seq + 1
+        if self.head - self.tail > self.slots:
+            self.tail = self.head - self.slots
+
+    def peek(self, i=0):
+        # Returns the i-th oldest sample as (ts, field1, field2, ...), None
+        # if there are not that many
+        if i >= self.head - self.tail:
+            return None
+        self.f.seek(((self.tail + i) % self.slots) * REC_SIZE)
+        self.f.readinto(self._rec)
+        return struct.unpack_from(REC_FMT, self._rec)[1:]
+
+    def drop(self, n=1):
+        # Remove the n oldest samples. Call save() to make it stick.
+        self.tail = min(self.tail + n, self.head)
+
+    def save(self):
+        # Write the tail to flash
+        struct.pack_into('<I', self._ack, 0, self.tail)
+        with open(self.ackname, 'wb') as f:
+            f.write(self._ack)
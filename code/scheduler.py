@@ -0,0 +1,126 @@
+import time
+import uasyncio as asyncio
+
+# Deadlines on time.ticks_ms(), wraparound safe (ticks_diff and ticks_add
+# only). A periodic job's next deadline is its last deadline plus the
+# period, not the time it ran plus the period, so it does not drift
+# however late each run is.
+#
+# A job that falls behind by more than a period catches up one of two
+# ways, chosen per job:
+#   catchup=True  -- every missed deadline is run, back to back
+#   catchup=False -- one run for all of them, then on to the next deadline
+#                    on the original grid. The skipped ones are counted in
+#                    missed.
+# Either way what happens depends only on how late it is.
+#
+# Each job keeps jitter stats: runs, missed, and the average and worst
+# lateness in ms. Scheduler.stats() lists them for all jobs.
+#
+# Jobs are waited for with 'await job.wait()' in a task, or polled with
+# Scheduler.due() from a plain loop.
+
+
+class Job:
+
+    def __init__(self, name, period_ms, first_ms, catchup):
+        # period_ms 0 is a one-shot
+        self.name = name
+        self.period = period_ms
+        self.catchup = catchup
+        self.deadline = time.ticks_add(time.ticks_ms(), first_ms)
+        self.done = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.runs = 0
+        self.missed = 0
+        self.late_sum = 0
+        self.late_max = 0
+
+    def in_ms(self):
+        # ms to the deadline, negative if it has passed
+        return time.ticks_diff(self.deadline, time.ticks_ms())
+
+    def take(self):
+        # If the deadline has passed, count a run, move on to the next
+        # deadline and return how many ms late it was. Else None.
+        if self.done:
+            return None
+        late = -self.in_ms()
+        if late < 0:
+            return None
+        self.runs += 1
+        self.late_sum += late
+        self.late_max = max(self.late_max, late)
+        if not self.period:
+            self.done = True
+        elif self.catchup:
+            self.deadline = time.ticks_add(self.deadline, self.period)
+        else:
+            skip = late // self.period
+            self.missed += skip
+            self.deadline = time.ticks_add(self.deadline, (skip + 1) * self.period)
+        return late
+
+    async def wait(self):
+        # Sleep until the deadline and take it. Returns ms late, or None
+        # for a one-shot already run.
+        while not self.done:
+            late = self.take()
+            if late is not None:
+                return late
+            await asyncio.sleep_ms(self.in_ms())
+        return None
+
+
+class Scheduler:
+
+    def __init__(self):
+        self.jobs = []
+
+    def every(self, name, period_ms, first_ms=None, catchup=False):
+        # Periodic job, first due after first_ms (default one period)
+        if first_ms is None:
+            first_ms = period_ms
+        job = Job(name, period_ms, first_ms, catchup)
+        self.jobs.append(job)
+        return job
+
+    def after(self, name, delay_ms):
+        # One-shot job due after delay_ms
+        job = Job(name, 0, delay_ms, False)
+        self.jobs.append(job)
+        return job
+
+    def next_ms(self):
+        # ms to the soonest deadline, 0 if one has passed, None if no jobs
+        # are left
+        ms = None
+        for job in self.jobs:
+            if not job.done:
+                t = max(job.in_ms(), 0)
+                if ms is None or t < ms:
+                    ms = t
+        return ms
+
+    def due(self):
+        # The most overdue job, taken, or None if none is due
+        best = None
+        for job in self.jobs:
+            if not job.done and job.in_ms() <= 0:
+                if best is None or job.in_ms() < best.in_ms():
+                    best = job
+        if best is not None:
+            best.take()
+        return best
+
+    def stats(self, reset=False):
+        # List of (name, runs, missed, average ms late, max ms late)
+        out = []
+        for job in self.jobs:
+            avg = job.late_sum // job.runs if job.runs else 0
+            out.append((job.name, job.runs, job.missed, avg, job.late_max))
+            if reset:
+                job.reset_stats()
+        return out
@@ -0,0 +1,164 @@
+# Host simulator for flowcounter. Run this on a PC with CPython, not on the
+# board:
+#   python3 sim_flowcounter.py
+#
+# Stands in for the MicroPython machine and time modules, then fires
+# synthetic pulses into FlowCount._cb_pulse() between bytecodes of the main
+# code, the way a pin IRQ does on the board. Pulses that come while IRQs are
+# disabled are held and fire at enable_irq(), as on the board. Pulses land at random points
+# inside snapshot_and_reset() and volume(), and every pulse must come out
+# in exactly one snapshot. The old counter with the reset flag is run the
+# same way for comparison. The glitch filter is checked with a fake clock.
+
+import sys
+import time
+import random
+import types
+
+# MicroPython stand-ins
+machine = types.ModuleType('machine')
+
+class Pin:
+    IN = 0
+    PULL_UP = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def irq(self, trigger=None, handler=None, hard=False):
+        self.handler = handler
+
+machine.Pin = Pin
+machine.Timer = object
+# IRQ mask, and pulses held while masked: [off, held, handler]
+_irq = [False, 0, None]
+
+
+def disable_irq():
+    state = _irq[0]
+    _irq[0] = True
+    return state
+
+
+def enable_irq(state):
+    _irq[0] = state
+    while not state and _irq[1]:
+        _irq[1] -= 1
+        _irq[2](None)
+
+
+machine.disable_irq = disable_irq
+machine.enable_irq = enable_irq
+sys.modules['machine'] = machine
+
+_t0 = time.perf_counter()
+time.ticks_us = lambda: int((time.perf_counter() - _t0) * 1e6) & 0x3FFFFFFF
+time.ticks_ms = lambda: int((time.perf_counter() - _t0) * 1e3) & 0x3FFFFFFF
+time.ticks_diff = lambda a, b: ((a - b + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+import flowcounter
+
+
+class OldFlowCount:
+    # The counter before the double buffering, for comparison
+    def __init__(self):
+        self.ctr_pulses = 0
+        self.ratio_ppl = 468
+        self.acc_liters = 0
+        self.ctr_reset = False
+
+    def _cb_pulse(self, _):
+        self.ctr_pulses += 1
+        if self.ctr_reset:
+            self.ctr_reset = False
+            self.acc_liters = 0
+            self.ctr_pulses = 0
+        elif self.ctr_pulses >= self.ratio_ppl:
+            self.ctr_pulses = 0
+            self.acc_liters += 1
+
+    def snapshot_and_reset(self):
+        liters = self.acc_liters + self.ctr_pulses / self.ratio_ppl
+        self.ctr_reset = True
+        self.acc_liters = 0
+        self.ctr_pulses = 0
+        return round(liters * self.ratio_ppl), liters, 0
+
+
+def run(flow, resets, prob, seed=1):
+    # Take resets snapshots while pulses fire at each bytecode of the main
+    # code with probability prob. Returns (pulses fired, pulses counted).
+    rnd = random.Random(seed)
+    fired = [0]
+
+    def trace(frame, event, arg):
+        if frame.f_code.co_name in ('_cb_pulse', 'disable_irq', 'enable_irq'):
+            return None     # the IRQ itself runs without interruption
+        frame.f_trace_opcodes = True
+        if event == 'opcode' and rnd.random() < prob:
+            fired[0] += 1
+            if _irq[0]:
+                _irq[1] += 1
+            else:
+                flow._cb_pulse(None)
+        return trace
+
+    counted = 0
+    _irq[2] = flow._cb_pulse
+    sys.settrace(trace)
+    try:
+        for _ in range(resets):
+            counted += flow.snapshot_and_reset()[0]
+    finally:
+        sys.settrace(None)
+    counted += flow.snapshot_and_reset()[0]
+    return fired[0], counted
+
+
+def check_glitch():
+    # Pulses at 1 kHz with a burst of noise edges after every 10th. Returns
+    # (pulses counted, glitches) which should be (1000, 3 * 100).
+    ticks_us = time.ticks_us
+    now = [0]
+    time.ticks_us = lambda: now[0]
+    try:
+        flow = flowcounter.FlowCount(Pin(14))
+        for i in range(1000):
+            now[0] = (now[0] + 1000) & 0x3FFFFFFF
+            flow._cb_pulse(None)
+            if i % 10 == 0:
+                for dt in (20, 50, 100):
+                    now[0] = (now[0] + dt) & 0x3FFFFFFF
+                    flow._cb_pulse(None)
+                now[0] = (now[0] - 170) & 0x3FFFFFFF
+        return flow.pulses(), flow.glitches
+    finally:
+        time.ticks_us = ticks_us
+
+
+def bench_irq(flow, n=100000):
+    # Host time per IRQ call. Only a relative figure for the board.
+    t = time.perf_counter()
+    for _ in range(n):
+        flow._cb_pulse(None)
+    return (time.perf_counter() - t) / n * 1e6
+
+
+if __name__ == '__main__':
+    # Filter off: pulses fire far faster than any real sensor here
+    flow = flowcounter.FlowCount(Pin(14), min_us=0)
+    ok = True
+    for prob in (0.01, 0.1, 0.5):
+        fired, counted = run(flow, 20000, prob)
+        old_fired, old_counted = run(OldFlowCount(), 20000, prob)
+        print('pulse chance {:4}: fired {:7}, counted {:7} {}   old counter: counted {:7} ({:+})'.format(
+            prob, fired, counted, 'OK' if fired == counted else 'LOST/EXTRA',
+            old_counted, old_counted - old_fired))
+        ok = ok and fired == counted
+    counted, glitches = check_glitch()
+    print('glitch filter: counted {} of 1000 pulses, {} of 300 glitches rejected'.format(
+        counted, glitches))
+    ok = ok and counted == 1000 and glitches == 300
+    print('IRQ handler: {:.2f} us per pulse on this host'.format(bench_irq(flow)))
+    sys.exit(0 if ok else 1)
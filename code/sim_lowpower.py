@@ -0,0 +1,183 @@
+# Host simulator for the lowpower deep sleep cycle. Run this on a PC with
+# CPython, not on the board:
+#   python3 sim_lowpower.py
+#
+# Stands in for the MicroPython modules, with RTC memory that lasts from one
+# wake to the next like it does over deep sleep. Each wake is a fresh
+# DeepCycle, as after a reset. Samples are numbered in field 2, and the
+# hotspot and Thingspeak fail at random and for a long outage that fills
+# RTC memory and spills to flash. Every sample must be posted exactly once
+# and in order.
+
+import sys
+import os
+import time
+import json
+import random
+import asyncio
+import tempfile
+import types
+
+# MicroPython stand-ins
+machine = types.ModuleType('machine')
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    IRQ_FALLING = 2
+    OPEN_DRAIN = 3
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class RTC:
+    _mem = b''          # kept over "resets", lost at power off
+
+    def memory(self, data=None):
+        if data is None:
+            return RTC._mem
+        assert len(data) <= 492, 'RTC memory is 492 bytes'
+        RTC._mem = bytes(data)
+
+
+machine.Pin = Pin
+machine.ADC = object
+machine.Timer = object
+machine.I2C = object
+machine.RTC = RTC
+machine.disable_irq = lambda: 0
+machine.enable_irq = lambda state: None
+machine.lightsleep = lambda ms: None
+sys.modules['machine'] = machine
+for name in ('network', 'onewire', 'ds18x20'):
+    sys.modules[name] = types.ModuleType(name)
+sys.modules['ujson'] = json
+sys.modules['uasyncio'] = asyncio
+
+_boot = [time.perf_counter()]
+time.ticks_ms = lambda: int((time.perf_counter() - _boot[0]) * 1e3) & 0x3FFFFFFF
+time.ticks_diff = lambda a, b: ((a - b + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+time.sleep_ms = lambda ms: None
+_time = time.time
+time.time = lambda: int(_time())      # whole seconds, as on the board
+
+rnd = random.Random(1)
+ntptime = types.ModuleType('ntptime')
+
+
+def _ntp_time():
+    if rnd.random() < 0.3:
+        raise OSError('timeout')
+    return time.time() + 1000
+
+
+ntptime.time = _ntp_time
+sys.modules['ntptime'] = ntptime
+
+import app
+import lowpower
+
+app.DRAIN_GAP = 0
+
+
+class FakeWIFI:
+    def radio(self, on):
+        pass
+
+    def resolve_url(self, url):
+        pass
+
+    async def http_close(self):
+        pass
+
+
+class SimCycle(lowpower.DeepCycle):
+    # The board parts faked: samples are numbered, the network fails at
+    # random, or always while down is set
+    n = 0
+    down = False
+    posted = []         # sample numbers in the order they went up
+    calls = 0
+
+    def sample(self):
+        n = float(SimCycle.n)
+        SimCycle.n += 1
+        return (0.0, n, 70.0, n, n, n, 0)
+
+    def connect(self):
+        self.wi = FakeWIFI()
+        return not SimCycle.down and rnd.random() > 0.2
+
+    async def post(self, n):
+        # A bulk update only takes timestamped samples
+        assert n == 1 or all(self.peek(i)[0] for i in range(n))
+        if SimCycle.down or rnd.random() < 0.1:
+            return 'er3'
+        SimCycle.calls += 1
+        for i in range(n):
+            SimCycle.posted.append(int(self.peek(i)[2]))
+        return 'ook'
+
+
+def run(config, wakes, outage):
+    # Returns a list of problems, empty if all is well
+    SimCycle.n = 0
+    SimCycle.posted = []
+    SimCycle.calls = 0
+    RTC._mem = b''
+    spilled = 0
+    for wake in range(wakes):
+        _boot[0] = time.perf_counter()      # reset
+        SimCycle.down = outage[0] <= wake < outage[1]
+        cycle = SimCycle(config)
+        cycle.step()
+        spilled = max(spilled, cycle.state.flash)
+    # Network back for good. Wake until everything is up.
+    SimCycle.down = False
+    extra = 0
+    while True:
+        cycle = SimCycle(config)
+        if not cycle.backlog():
+            break
+        cycle.step()
+        extra += 1
+    st = cycle.state
+    problems = []
+    if SimCycle.posted != list(range(SimCycle.n)):
+        lost = set(range(SimCycle.n)) - set(SimCycle.posted)
+        problems.append('posted {} of {} samples, {} lost, in order: {}'.format(
+            len(SimCycle.posted), SimCycle.n, len(lost),
+            SimCycle.posted == sorted(SimCycle.posted)))
+    if st.wakes != wakes + extra or st.samples != SimCycle.n:
+        problems.append('counters: wakes {} samples {}'.format(st.wakes, st.samples))
+    if st.posts != SimCycle.calls:
+        problems.append('counters: posts {} of {}'.format(st.posts, SimCycle.calls))
+    if not spilled:
+        problems.append('outage did not spill to flash')
+    if st.lat_max < st.lat_last or st.clock_offset is None:
+        problems.append('latency or clock not recorded')
+    print('  {} wakes, {} samples, {} posts, {} failed uploads, up to {} on flash, '
+          'wake to post max {} ms'.format(st.wakes, st.samples, st.posts, st.fails,
+                                          spilled, st.lat_max))
+    return problems
+
+
+if __name__ == '__main__':
+    os.chdir(tempfile.mkdtemp())        # the flash queue file goes here
+    print('RTC memory: {} byte header, {} samples of {} bytes'.format(
+        lowpower.HDR_SIZE, lowpower.RTC_SLOTS, lowpower.REC_SIZE))
+    ok = True
+    for config in ({'api_key': 'KEY'},
+                   {'api_key': 'KEY', 'channel_id': 1, 'post_batch': 5}):
+        print('bulk' if 'channel_id' in config else 'single')
+        for f in os.listdir('.'):
+            os.remove(f)
+        problems = run(config, 1000, (300, 450))
+        for p in problems:
+            print('  ' + p)
+        ok = ok and not problems
+    print('OK' if ok else 'FAIL')
+    sys.exit(0 if ok else 1)
@@ -1,46 +1,16 @@
-# The MIT License (MIT)
-#
-# Copyright (c) 2017 Michael McWethy
-#
-# Permission is hereby granted, free of charge, to any person obtaining a copy
-# of this software and associated documentation files (the "Software"), to deal
-# in the Software without restriction, including without limitation the rights
-# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
-# copies of the Software, and to permit persons to whom the Software is
-# furnished to do so, subject to the following conditions:
-#
-# The above copyright notice and this permission notice shall be included in
-# all copies or substantial portions of the Software.
-#
-# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
-# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
-# THE SOFTWARE.
 """
-`adafruit_ssd1306`
-====================================================
-
 MicroPython SSD1306 OLED driver, I2C and SPI interfaces
 
-* Author(s): Tony DiCola, Michael McWethy
+Built directly on machine.I2C / machine.SPI and framebuf so it runs on the
+ESP8266 port (no adafruit_bus_device). Command sequences such as init, the
+show() window and contrast go out as a single bus transaction, and the
+buffers are allocated once when the display is created.
 """
 
 import time
-
 from micropython import const
-from adafruit_bus_device import i2c_device, spi_device
-try:
-    import framebuf
-except ImportError:
-    import adafruit_framebuf as framebuf
+import framebuf
 
-__version__ = "0.0.0-auto.0"
-__repo__ = "https://github.com/adafruit/Adafruit_CircuitPython_SSD1306.git"
-
-#pylint: disable-msg=bad-whitespace
 # register definitions
 SET_CONTRAST        = const(0x81)
 SET_ENTIRE_ON       = const(0xa4)
@@ -59,176 +29,228 @@ SET_DISP_CLK_DIV    = const(0xd5)
 SET_PRECHARGE       = const(0xd9)
 SET_VCOM_DESEL      = const(0xdb)
 SET_CHARGE_PUMP     = const(0x8d)
-#pylint: enable-msg=bad-whitespace
+SET_HSCROLL         = const(0x26)   # | 1 to scroll left
+SET_VHSCROLL        = const(0x29)   # + 1 to scroll left
+SET_SCROLL_OFF      = const(0x2e)
+SET_SCROLL_ON       = const(0x2f)
+SET_VSCROLL_AREA    = const(0xa3)
 
 
-class _SSD1306(framebuf.FrameBuffer):
+class SSD1306(framebuf.FrameBuffer):
     """Base class for SSD1306 display driver"""
-    #pylint: disable-msg=too-many-arguments
-    def __init__(self, buffer, width, height, *, external_vcc, reset):
-        super().__init__(buffer, width, height)
+
+    def __init__(self, width, height, external_vcc):
         self.width = width
         self.height = height
         self.external_vcc = external_vcc
-        # reset may be None if not needed
-        self.reset_pin = reset
-        if self.reset_pin:
-            self.reset_pin.switch_to_output(value=0)
         self.pages = self.height // 8
-        # Note the subclass must initialize self.framebuf to a framebuffer.
-        # This is necessary because the underlying data buffer is different
-        # between I2C and SPI implementations (I2C needs an extra byte).
-        self.poweron()
+        self.buffer = bytearray(self.pages * self.width)
+        self.fbuf = memoryview(self.buffer)     # framebuffer bytes, page by page
+        super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
+        # Reused for every command batch (longest is a scroll setup)
+        self._cmd = bytearray(12)
+        self._cmdv = memoryview(self._cmd)
         self.init_display()
 
     def init_display(self):
-        """Base class to initialize display"""
-        for cmd in (
-                SET_DISP | 0x00, # off
-                # address setting
-                SET_MEM_ADDR, 0x00, # horizontal
-                # resolution and layout
-                SET_DISP_START_LINE | 0x00,
-                SET_SEG_REMAP | 0x01, # column addr 127 mapped to SEG0
-                SET_MUX_RATIO, self.height - 1,
-                SET_COM_OUT_DIR | 0x08, # scan from COM[N] to COM0
-                SET_DISP_OFFSET, 0x00,
-                SET_COM_PIN_CFG, 0x02 if self.height == 32 else 0x12,
-                # timing and driving scheme
-                SET_DISP_CLK_DIV, 0x80,
-                SET_PRECHARGE, 0x22 if self.external_vcc else 0xf1,
-                SET_VCOM_DESEL, 0x30, # 0.83*Vcc
-                # display
-                SET_CONTRAST, 0xff, # maximum
-                SET_ENTIRE_ON, # output follows RAM contents
-                SET_NORM_INV, # not inverted
-                # charge pump
-                SET_CHARGE_PUMP, 0x10 if self.external_vcc else 0x14,
-                SET_DISP | 0x01): # on
-            self.write_cmd(cmd)
+        """Initialize the display with one command transaction"""
+        self.write_cmds(bytes((
+            SET_DISP | 0x00, # off
+            # address setting
+            SET_MEM_ADDR, 0x00, # horizontal
+            # resolution and layout
+            SET_DISP_START_LINE | 0x00,
+            SET_SEG_REMAP | 0x01, # column addr 127 mapped to SEG0
+            SET_MUX_RATIO, self.height - 1,
+            SET_COM_OUT_DIR | 0x08, # scan from COM[N] to COM0
+            SET_DISP_OFFSET, 0x00,
+            SET_COM_PIN_CFG, 0x02 if self.height == 32 else 0x12,
+            # timing and driving scheme
+            SET_DISP_CLK_DIV, 0x80,
+            SET_PRECHARGE, 0x22 if self.external_vcc else 0xf1,
+            SET_VCOM_DESEL, 0x30, # 0.83*Vcc
+            # display
+            SET_CONTRAST, 0xff, # maximum
+            SET_ENTIRE_ON, # output follows RAM contents
+            SET_NORM_INV, # not inverted
+            SET_SCROLL_OFF,
+            # charge pump
+            SET_CHARGE_PUMP, 0x10 if self.external_vcc else 0x14,
+            SET_DISP | 0x01))) # on
         self.fill(0)
         self.show()
 
+    def write_cmd(self, cmd):
+        """Send a single command"""
+        self._cmd[0] = cmd
+        self.write_cmds(self._cmdv[:1])
+
+    def write_cmds(self, buf):
+        """Derived class must implement this. Sends all the commands in buf
+        in one transaction."""
+        raise NotImplementedError
+
+    def write_data(self, buf):
+        """Derived class must implement this. Sends buf to display RAM in one
+        transaction."""
+        raise NotImplementedError
+
     def poweroff(self):
         """Turn off the display (nothing visible)"""
         self.write_cmd(SET_DISP | 0x00)
 
+    def poweron(self):
+        """Turn on the display"""
+        self.write_cmd(SET_DISP | 0x01)
+
     def contrast(self, contrast):
-        """Adjust the contrast"""
-        self.write_cmd(SET_CONTRAST)
-        self.write_cmd(contrast)
+        """Adjust the contrast (0 to 255)"""
+        self._cmd[0] = SET_CONTRAST
+        self._cmd[1] = contrast
+        self.write_cmds(self._cmdv[:2])
 
     def invert(self, invert):
         """Invert all pixels on the display"""
         self.write_cmd(SET_NORM_INV | (invert & 1))
 
-    def write_framebuf(self):
-        """Derived class must implement this"""
-        raise NotImplementedError
+    def hw_scroll(self, left=False, page0=0, page1=None, interval=0, vstep=0):
+        """Let the display scroll pages page0 to page1 by itself. interval is
+        the 3 bit frame interval code from the datasheet (0 = every 5
+        frames). A vstep of 1 to height-1 also scrolls that many rows up
+        each step."""
+        if page1 is None:
+            page1 = self.pages - 1
+        cmd = self._cmd
+        cmd[0] = SET_SCROLL_OFF     # must be off while setting up
+        if vstep:
+            cmd[1] = SET_VSCROLL_AREA
+            cmd[2] = 0
+            cmd[3] = self.height
+            cmd[4] = SET_VHSCROLL + (1 if left else 0)
+            n = 5
+        else:
+            cmd[1] = SET_HSCROLL | (0x01 if left else 0x00)
+            n = 2
+        cmd[n] = 0x00
+        cmd[n + 1] = page0
+        cmd[n + 2] = interval
+        cmd[n + 3] = page1
+        if vstep:
+            cmd[n + 4] = vstep
+            n += 5
+        else:
+            cmd[n + 4] = 0x00
+            cmd[n + 5] = 0xff
+            n += 6
+        cmd[n] = SET_SCROLL_ON
+        self.write_cmds(self._cmdv[:n + 1])
 
-    def write_cmd(self, cmd):
-        """Derived class must implement this"""
-        raise NotImplementedError
-
-    def poweron(self):
-        "Reset device and turn on the display."
-        if self.reset_pin:
-            self.reset_pin.value = 1
-            time.sleep(0.001)
-            self.reset_pin.value = 0
-            time.sleep(0.010)
-            self.reset_pin.value = 1
-            time.sleep(0.010)
-        self.write_cmd(SET_DISP | 0x01)
+    def hw_scroll_stop(self):
+        """Stop scrolling. The display RAM gets scrambled by scrolling, so
+        call show() afterwards."""
+        self.write_cmd(SET_SCROLL_OFF)
 
-    def show(self):
-        """Update the display"""
-        xpos0 = 0
-        xpos1 = self.width - 1
+    def show(self, col0=0, col1=None, page0=0, page1=None):
+        """Update the display. Give a column and page window to send only
+        that part of the framebuffer."""
+        if col1 is None:
+            col1 = self.width - 1
+        if page1 is None:
+            page1 = self.pages - 1
+        xpos0 = col0
+        xpos1 = col1
         if self.width == 64:
             # displays with width of 64 pixels are shifted by 32
             xpos0 += 32
             xpos1 += 32
-        self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(xpos0)
-        self.write_cmd(xpos1)
-        self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_framebuf()
-
-class SSD1306_I2C(_SSD1306):
+        cmd = self._cmd
+        cmd[0] = SET_COL_ADDR
+        cmd[1] = xpos0
+        cmd[2] = xpos1
+        cmd[3] = SET_PAGE_ADDR
+        cmd[4] = page0
+        cmd[5] = page1
+        self.write_cmds(self._cmdv[:6])
+        if col0 == 0 and col1 == self.width - 1:
+            # Whole pages are contiguous in the framebuffer
+            self.write_data(self.fbuf[page0 * self.width:(page1 + 1) * self.width])
+        else:
+            # The display wraps to the next page inside the window, so
+            # send each page's columns in turn
+            for page in range(page0, page1 + 1):
+                start = page * self.width + col0
+                self.write_data(self.fbuf[start:start + col1 - col0 + 1])
+
+
+class SSD1306_I2C(SSD1306):
     """
     I2C class for SSD1306
 
     :param width: the width of the physical screen in pixels,
     :param height: the height of the physical screen in pixels,
-    :param i2c: the I2C peripheral to use,
-    :param addr: the 8-bit bus address of the device,
+    :param i2c: the machine.I2C peripheral to use,
+    :param addr: the 7-bit bus address of the device,
     :param external_vcc: whether external high-voltage source is connected.
-    :param reset: if needed, DigitalInOut designating reset pin
     """
 
-    def __init__(self, width, height, i2c, *, addr=0x3c, external_vcc=False, reset=None):
-        self.i2c_device = i2c_device.I2CDevice(i2c, addr)
+    def __init__(self, width, height, i2c, addr=0x3c, external_vcc=False):
+        self.i2c = i2c
         self.addr = addr
-        self.temp = bytearray(2)
-        # Add an extra byte to the data buffer to hold an I2C data/command byte
-        # to use hardware-compatible I2C transactions.  A memoryview of the
-        # buffer is used to mask this byte from the framebuffer operations
-        # (without a major memory hit as memoryview doesn't copy to a separate
-        # buffer).
-        self.buffer = bytearray(((height // 8) * width) + 1)
-        self.buffer[0] = 0x40  # Set first byte of data buffer to Co=0, D/C=1
-        super().__init__(memoryview(self.buffer)[1:], width, height,
-                         external_vcc=external_vcc, reset=reset)
+        # Control byte and payload, sent together with writevto()
+        self._vec = [b'\x00', None]
+        super().__init__(width, height, external_vcc)
 
-    def write_cmd(self, cmd):
-        """Send a command to the SPI device"""
-        self.temp[0] = 0x80 # Co=1, D/C#=0
-        self.temp[1] = cmd
-        with self.i2c_device:
-            self.i2c_device.write(self.temp)
-
-    def write_framebuf(self):
-        """Blast out the frame buffer using a single I2C transaction to support
-        hardware I2C interfaces."""
-        with self.i2c_device:
-            self.i2c_device.write(self.buffer)
-
-#pylint: disable-msg=too-many-arguments
-class SSD1306_SPI(_SSD1306):
+    def write_cmds(self, buf):
+        self._vec[0] = b'\x00'  # Co=0, D/C#=0: everything after is commands
+        self._vec[1] = buf
+        self.i2c.writevto(self.addr, self._vec)
+
+    def write_data(self, buf):
+        self._vec[0] = b'\x40'  # Co=0, D/C#=1: everything after is data
+        self._vec[1] = buf
+        self.i2c.writevto(self.addr, self._vec)
+
+
+class SSD1306_SPI(SSD1306):
     """
     SPI class for SSD1306
 
     :param width: the width of the physical screen in pixels,
     :param height: the height of the physical screen in pixels,
-    :param spi: the SPI peripheral to use,
+    :param spi: the machine.SPI peripheral to use,
     :param dc: the data/command pin to use (often labeled "D/C"),
-    :param reset: the reset pin to use,
+    :param res: the reset pin to use,
     :param cs: the chip-select pin to use (sometimes labeled "SS").
     """
-    # pylint: disable=no-member
-    # Disable should be reconsidered when refactor can be tested.
-    def __init__(self, width, height, spi, dc, reset, cs, *,
-                 external_vcc=False, baudrate=8000000, polarity=0, phase=0):
-        self.rate = 10 * 1024 * 1024
-        dc.switch_to_output(value=0)
-        self.spi_device = spi_device.SPIDevice(spi, cs, baudrate=baudrate,
-                                               polarity=polarity, phase=phase)
-        self.dc_pin = dc
-        self.buffer = bytearray((height // 8) * width)
-        super().__init__(memoryview(self.buffer), width, height,
-                         external_vcc=external_vcc, reset=reset)
 
-    def write_cmd(self, cmd):
-        """Send a command to the SPI device"""
-        self.dc_pin.value = 0
-        with self.spi_device as spi:
-            spi.write(bytearray([cmd]))
-
-    def write_framebuf(self):
-        """write to the frame buffer via SPI"""
-        self.dc_pin.value = 1
-        with self.spi_device as spi:
-            spi.write(self.buffer)
+    def __init__(self, width, height, spi, dc, res, cs, external_vcc=False,
+                 baudrate=8000000):
+        self.rate = baudrate
+        dc.init(dc.OUT, value=0)
+        res.init(res.OUT, value=0)
+        cs.init(cs.OUT, value=1)
+        self.spi = spi
+        self.dc = dc
+        self.res = res
+        self.cs = cs
+        # Reset the display
+        res(1)
+        time.sleep_ms(1)
+        res(0)
+        time.sleep_ms(10)
+        res(1)
+        super().__init__(width, height, external_vcc)
+
+    def _write(self, dc, buf):
+        self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        self.cs(1)
+        self.dc(dc)
+        self.cs(0)
+        self.spi.write(buf)
+        self.cs(1)
+
+    def write_cmds(self, buf):
+        self._write(0, buf)
+
+    def write_data(self, buf):
+        self._write(1, buf)
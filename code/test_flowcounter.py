@@ -10,6 +10,7 @@ PIN_BUTTON = 0          # GPIO0 is onboard button
 disp = oled.OLED()
 disp.clear()
 disp.text('Flowcounter Test', row=0)
+disp.commit()
 
 btn = Button(Pin(PIN_BUTTON, Pin.IN, Pin.PULL_UP), activelow=True)
 flow = FlowCount(Pin(PIN_FLOWCOUNTER, Pin.IN, Pin.PULL_UP))
@@ -17,6 +18,8 @@ flow = FlowCount(Pin(PIN_FLOWCOUNTER, Pin.IN, Pin.PULL_UP))
 while True:
     if btn.was_pressed():
         flow.volume(reset=True)
-    disp.text('pulses:{}     '.format(flow.ctr_pulses), row=1)
+    flow.update()
+    disp.text('p:{} gl:{}     '.format(flow.pulses(), flow.glitches), row=1)
     disp.text('liters:{:.3f}     '.format(flow.volume()), row=2)
+    disp.commit()
     sleep(0.2)
@@ -4,38 +4,102 @@ import time
 
 BAD_READ_LOW = -30      # -30C = -22F
 BAD_READ_HIGH = 65      # 65C = 149F
-DELAY_CONV_S = 0.75
+CONV_MS = 750           # DS18B20 12 bit conversion time
+RETRIES = 2             # more conversions for bad readings
+NO_TEMP = -99.99        # no reading, in C or F
+NO_TEMP_M = -99990      # no reading, in milli-degrees
 
-class Thermometer:
-    def __init__(self, pin, addr):
-        # Setup OneWire bus and temp sensor
-        #   pin = GPIO pin
-        #   rom = specific device's address in ROM code (a 8-value bytearray)
+# All the DS18B20s on one 1-Wire pin. The bus is scanned once at start up.
+# start_conv() sends a single Skip-ROM convert so every sensor converts at
+# the same time, and each one is then read by its ROM. N sensors cost one
+# conversion wait, not N.
+#
+# Nothing blocks for the conversion. Poll ready() until it returns True,
+# then result() has the temperatures. ready() reads the sensors once
+# CONV_MS has passed since the convert. A scratchpad that fails its CRC,
+# or a reading out of range (e.g. the 85C power on value), gets another
+# conversion, up to RETRIES times, and ready() stays False meanwhile.
+#
+# Sensors are named. Give the names and ROMs (8 byte lists) in a dict;
+# sensors found on the bus that are not in it are named by their ROM in hex.
+
+
+def rom_name(rom):
+    return ''.join('{:02x}'.format(b) for b in rom)
+
+
+class Bus:
+    def __init__(self, pin, names=None):
+        # pin = GPIO pin
+        # names = dict of name: ROM code
         self.ow = onewire.OneWire(pin)
-        self.addr = addr
-        self.ow.select_rom(self.addr)
         self.sensor = ds18x20.DS18X20(self.ow)
-        self.temp = -99.99
+        self.roms = {}
+        if names:
+            for name in names:
+                self.roms[name] = bytearray(names[name])
+        known = list(self.roms.values())
+        for rom in self.sensor.scan():
+            if rom not in known:
+                self.roms[rom_name(rom)] = rom
+        self.temps = {}
+        self._mF = {}           # same in milli-degrees F, for temp_mF()
+        for name in self.roms:
+            self.temps[name] = NO_TEMP
+            self._mF[name] = NO_TEMP_M
+        self._todo = []         # sensors still to read
+        self._tries = 0
+        self._t_conv = 0
 
-    def start_conv(self):
-        # Send command to sensor to start conversion
+    def _convert(self):
+        # Start a conversion on all sensors at once (Skip ROM)
         self.sensor.convert_temp()
+        self._t_conv = time.ticks_ms()
+
+    def start_conv(self):
+        # Start reading all the sensors
+        self._todo = list(self.roms)
+        self._tries = RETRIES
+        self._convert()
+
+    def _read(self, name):
+        # Read one sensor. ds18x20 checks the scratchpad CRC. Returns False
+        # if the reading is no good.
+        try:
+            t = self.sensor.read_temp(self.roms[name])
+        except Exception:   # CRC error, or the sensor is gone
+            self.temps[name] = NO_TEMP
+            self._mF[name] = NO_TEMP_M
+            return False
+        self.temps[name] = t
+        self._mF[name] = int(t * 1000) * 9 // 5 + 32000
+        return BAD_READ_LOW < t < BAD_READ_HIGH
+
+    def ready(self):
+        # True when the readings started by start_conv() are in
+        if not self._todo:
+            return True
+        if time.ticks_diff(time.ticks_ms(), self._t_conv) < CONV_MS:
+            return False
+        self._todo = [name for name in self._todo if not self._read(name)]
+        if self._todo and self._tries:
+            self._tries -= 1
+            self._convert()
+            return False
+        self._todo = []
+        return True
+
+    def result(self):
+        # Dict of name: temperature C from the last reading
+        return self.temps
+
+    def temp_C(self, name):
+        return self.temps.get(name, NO_TEMP)
+
+    def temp_F(self, name):
+        t = self.temp_C(name)
+        return NO_TEMP if t == NO_TEMP else t * 9/5 + 32
 
-    def temp_C(self, last=False):
-        # Do not call this until 750 ms or more after start_conv()
-        if last:
-            return self.temp
-        self.temp = self.sensor.read_temp(self.addr)
-
-        # Reread if bad. Have gotten bad (e.g. 85C (185F) reading at room temp.
-        if self.temp <= BAD_READ_LOW or self.temp >= BAD_READ_HIGH:
-            self.sensor.convert_temp()
-            time.sleep(DELAY_CONV_S)
-            self.temp = self.sensor.read_temp(self.addr)
-        return self.temp
-
-    def temp_F(self, last=False):
-        # Do not call this until 750 ms or more after start_conv()
-        if last:
-            return self.temp * 9/5 + 32
-        return self.temp_C() * 9/5 + 32
+    def temp_mF(self, name):
+        # Last reading in milli-degrees F, an int worked out when it was read
+        return self._mF.get(name, NO_TEMP_M)
@@ -0,0 +1,120 @@
+import time
+from fixfmt import put_str, put_int, put_float, put_time
+
+# Body for Thingspeak's bulk JSON update. Several timestamped samples go up
+# in one POST instead of one GET each:
+#   {"write_api_key":"KEY","updates":[
+#     {"created_at":"2026-10-18T08:00:00Z","field1":1.234,"field2":24.5,...},
+#     ...]}
+# The body is rendered into a buffer allocated once, digit by digit with
+# fixfmt, and sent straight from it as a memoryview.
+#
+# A single update is a GET with the fields in the URL, see put_update().
+#
+# Uploader posts the oldest waiting samples either way, as app.App and
+# lowpower.DeepCycle both do.
+
+BULK_MAX = 10       # samples per POST
+REC_MAX = 192       # bytes, longest rendered sample
+URL_POST = 'https://api.thingspeak.com/update?api_key={}'
+URL_BULK = 'https://api.thingspeak.com/channels/{}/bulk_update.json'
+URL_MAX = 256       # bytes, longest single update URL
+
+
+def put_update(buf, pos, rec, decs):
+    # Write the query for a single update of rec = (ts, field1, field2, ...)
+    # into buf at pos, after the api_key. ts 0 means now.
+    for i in range(1, len(rec)):
+        pos = put_str(buf, pos, b'&field')
+        pos = put_int(buf, pos, i)
+        pos = put_str(buf, pos, b'=')
+        pos = put_float(buf, pos, rec[i], decs[i - 1])
+    if rec[0]:
+        pos = put_str(buf, pos, b'&created_at=')
+        pos = put_time(buf, pos, time.localtime(rec[0]))
+    return pos
+
+
+class BulkBody:
+    def __init__(self, api_key, decs, size=BULK_MAX):
+        # decs is the number of decimals for each field
+        self.size = size
+        self.decs = decs
+        self._head = ('{"write_api_key":"%s","updates":[' % api_key).encode()
+        self.buf = bytearray(len(self._head) + size * REC_MAX + 2)
+        self.mv = memoryview(self.buf)
+        self.start()
+
+    def start(self):
+        # Begin a new body
+        self.n = 0
+        self.pos = put_str(self.buf, 0, self._head)
+
+    def add(self, ts, fields):
+        # Add a sample. ts is seconds since the epoch, UTC. fields are the
+        # values of field1, field2, ...
+        if self.n >= self.size:
+            raise IndexError('bulk body full')
+        buf = self.buf
+        pos = self.pos
+        if self.n:
+            pos = put_str(buf, pos, b',')
+        pos = put_str(buf, pos, b'{"created_at":"')
+        pos = put_time(buf, pos, time.localtime(ts))
+        pos = put_str(buf, pos, b'"')
+        for i in range(len(fields)):
+            pos = put_str(buf, pos, b',"field')
+            pos = put_int(buf, pos, i + 1)
+            pos = put_str(buf, pos, b'":')
+            pos = put_float(buf, pos, fields[i], self.decs[i])
+        self.pos = put_str(buf, pos, b'}')
+        self.n += 1
+
+    def end(self):
+        # Finish the body. Returns it as a memoryview into the buffer.
+        self.pos = put_str(self.buf, self.pos, b']}')
+        return self.mv[:self.pos]
+
+
+class Uploader:
+    def __init__(self, config, decs):
+        # Bulk updates need the channel_id in config. Without it samples go
+        # one by one. batch is how many to wait for before posting.
+        self.decs = decs
+        self.bulk = None
+        self.batch = 1
+        if 'channel_id' in config:
+            self.bulk = BulkBody(config['api_key'], decs)
+            self.url_bulk = URL_BULK.format(config['channel_id'])
+            self.batch = config.get('post_batch', BULK_MAX)
+
+        # Single updates are made in this buffer after the fixed start
+        self._url = bytearray(URL_MAX)
+        self._urlv = memoryview(self._url)
+        self._url_head = put_str(self._url, 0, URL_POST.format(config['api_key']))
+
+    def count(self, peek):
+        # Number of samples from the oldest on to post next. peek(i) returns
+        # the i-th oldest, or None. A bulk update takes those with a
+        # timestamp, at least 2; else it's one on its own.
+        if self.bulk is None:
+            return 1
+        n = 0
+        while n < self.bulk.size:
+            rec = peek(n)
+            if rec is None or not rec[0]:
+                break
+            n += 1
+        return n if n >= 2 else 1
+
+    async def post(self, wi, peek, n):
+        # Post the n oldest samples over wi, in a bulk update if more than
+        # one. Returns the wifi status short code.
+        if n > 1:
+            self.bulk.start()
+            for i in range(n):
+                rec = peek(i)
+                self.bulk.add(rec[0], rec[1:])
+            return await wi.http_post_async(self.url_bulk, self.bulk.end())
+        pos = put_update(self._url, self._url_head, peek(0), self.decs)
+        return await wi.http_get_async(self._urlv[:pos])
@@ -1,19 +1,119 @@
 import network, socket
+import sys
 import time
+import ujson
+try:
+    import ubinascii as binascii
+except:
+    import binascii
+import uasyncio as asyncio
+from fixfmt import put_str, put_int
 
 
 SOCK_TIMEOUT = 20           # wait for socket requests, in seconds
+DNS_TTL = 3600              # keep resolved addresses N seconds
+DNS_NEG_TTL = 60            # don't retry a failed lookup for N seconds
+REQ_MAX = 512               # bytes, longest request line and headers
+KEEP_IDLE_MS = 4000         # open a fresh connection after N ms unused
+
+# Reconnecting. The AP (BSSID and channel) and IP config of the last good
+# connection are kept in WIFI_CACHE on flash. After a drop the first try
+# goes straight to that AP with the same static IP: no scan, no DHCP. If
+# that isn't up in FAST_TIMEOUT, it's back to scanning, starting SCAN_MIN
+# apart and doubling after each miss up to SCAN_MAX. The ESP8266 can't turn
+# DHCP back on once a static IP is set, and a phone hotspot may come back on
+# another subnet, so there the fast try goes to the cached AP with DHCP and
+# only skips the scan.
+WIFI_CACHE = 'wifi.json'
+FAST_TIMEOUT = 5            # seconds
+TRY_TIMEOUT = 20            # seconds to get connected after a scan found the AP
+SCAN_MIN = 2                # seconds
+SCAN_MAX = 120
+
+
+class Resolver:
+    # Small DNS cache. Lookups over the hotspot are slow and often fail, so
+    # addresses are kept for ttl seconds, failures for neg_ttl seconds, and
+    # the last good address is used when a lookup fails.
+
+    def __init__(self, ttl=DNS_TTL, neg_ttl=DNS_NEG_TTL):
+        self.ttl = ttl
+        self.neg_ttl = neg_ttl
+        self._cache = {}    # host: [last good IP or '', expires, retry after]
+
+    def resolve(self, host, port=80):
+        # Returns the IP address of host as a string. Raises OSError if it
+        # can't be resolved and there is no earlier address.
+        now = time.time()
+        ent = self._cache.get(host)
+        if ent is not None:
+            if now < ent[1]:
+                return ent[0]
+            if now < ent[2]:
+                # Failed recently. Don't hold things up with another try.
+                if ent[0]:
+                    return ent[0]
+                raise OSError('DNS failed: ' + host)
+        else:
+            ent = ['', 0, 0]
+            self._cache[host] = ent
+
+        try:
+            ip = socket.getaddrinfo(host, port)[0][-1][0]
+        except (OSError, IndexError):
+            ent[2] = now + self.neg_ttl
+            if ent[0]:
+                print('WARN: DNS failed, using last address for', host)
+                return ent[0]
+            raise OSError('DNS failed: ' + host)
+        ent[0] = ip
+        ent[1] = now + self.ttl
+        return ip
+
+    def cached(self, host):
+        # Returns the last good IP address of host, stale or not, or None.
+        # Never does a lookup, so it doesn't block.
+        ent = self._cache.get(host)
+        if ent is None or not ent[0]:
+            return None
+        return ent[0]
+
+    def forget(self, host):
+        # Drop the cached address, e.g. when connecting to it failed
+        ent = self._cache.get(host)
+        if ent is not None:
+            ent[1] = 0
+
+
+# Shared by every network caller (see ntptime)
+resolver = Resolver()
+
+
 class WIFI:
 
     stat_code = {
-        'find':'fnd',       # searching for AP
+        'find':'fnd',       # searching for AP (or fast reconnect)
         'trying':'ip?',     # connected, waiting for IP address
         'connected':'con'}  # connected
 
     def __init__(self, hostname=''):
-        self.scan_rate = 15                         # seconds between scans
-        self._last_scan = 0
+        self.scan_rate = SCAN_MIN                   # seconds between scans
+        self._next_scan = 0
         self._check_state = 'find'
+        self._try_until = 0     # give up on a connect attempt then
+        self._fast = False      # connect attempt is a fast reconnect
+        self._fast_tried = False
+        self._ap = None         # AP found by the last scan
+        self._static = False    # cached IP config set, DHCP off
+        self._can_dhcp = sys.platform != 'esp8266'  # DHCP back on after static
+        self.radio_is_on = True
+        self._on_s = 0          # seconds the radio was on before _on_since
+        self._on_since = time.time()
+        try:
+            with open(WIFI_CACHE) as f:
+                self._cache = ujson.load(f)
+        except (OSError, ValueError):
+            self._cache = None
         self.hostname = hostname
         self._is_connected = False
         self.ap = network.WLAN(network.AP_IF)
@@ -23,6 +123,9 @@ class WIFI:
         self.wlan.active(True)                      # activate the interface
         self.mac = self.wlan.config('mac')          # get the interface's MAC address
         self.ip = '0.0.0.0'
+        self._conn = None       # kept-alive HTTP connection [host, port, reader, writer, last used ms]
+        self._req = bytearray(REQ_MAX)  # request line and headers go out from here
+        self._reqv = memoryview(self._req)
         #print(self.wlan.ifconfig())                 # get the interface's IP/netmask/gw/DNS addresses
 
     @property
@@ -54,10 +157,42 @@ class WIFI:
 
     def disconnect(self):
         self._is_connected = False
+        if self._conn:
+            try:
+                self._conn[3].close()
+            except OSError:
+                pass
+            self._conn = None
         self.ip = '0.0.0.0'
         if self.wlan.isconnected():
             self.wlan.disconnect()
 
+    def radio(self, on):
+        # Turn the station interface on or off. Off saves the most power.
+        # The connection is dropped, and made again when turned back on
+        # (fast, see WIFI_CACHE).
+        if on == self.radio_is_on:
+            return
+        now = time.time()
+        if on:
+            self.wlan.active(True)
+            self._on_since = now
+        else:
+            self.disconnect()
+            self.wlan.active(False)
+            self._on_s += now - self._on_since
+        self.radio_is_on = on
+        self._check_state = 'find'
+        self._fast_tried = False
+        self._next_scan = 0
+        self.scan_rate = SCAN_MIN
+
+    def radio_on_s(self):
+        # Total seconds the radio has been on
+        if self.radio_is_on:
+            return self._on_s + time.time() - self._on_since
+        return self._on_s
+
     def scan(self, printable=False):
         aps = self.wlan.scan()
 
@@ -73,45 +208,199 @@ class WIFI:
             print('{}, {}'.format(name, signal))
 
     def find(self, ap):
+        return self._find_ap(ap) is not None
+
+    def _find_ap(self, ap):
+        # Returns the scan result of AP named ap, strongest if there are
+        # several, None if not found
         try:
             aps = self.wlan.scan()
         except OSError:     # sometimes a scan will return "OSError: scan failed"
-            return False
+            return None
         ap = ap.encode()
         
         # Each line will look like: (b'Starbucks WiFi', b'\xe0\xcb\xbc\x92\x1f\xe6', 11, -41, 0, 0)
+        best = None
         for _ap in aps:
-            if ap == _ap[0]:
-                return True
-        return False
+            if ap == _ap[0] and (best is None or _ap[3] > best[3]):
+                best = _ap
+        return best
+
+    def _connect_fast(self, ssid, pwd):
+        # Connect straight to the cached AP, with the cached IP config if
+        # DHCP can be turned back on should it fail
+        cache = self._cache
+        try:
+            if self._can_dhcp:
+                self.wlan.ifconfig(tuple(cache['ifconfig']))
+                self._static = True
+            self.wlan.connect(ssid, pwd, bssid=binascii.unhexlify(cache['bssid']))
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def _dhcp(self):
+        # Back to DHCP after the cached IP config was set. Returns False if
+        # this port can't after all, and no static config is set from then on.
+        if not self._static:
+            return True
+        try:
+            self.wlan.ifconfig('dhcp')
+        except (OSError, ValueError, TypeError):
+            self._can_dhcp = False
+            return False
+        self._static = False
+        return True
+
+    def _save_cache(self, ssid):
+        # Keep the AP and IP config of this connection. Written to flash only
+        # when something changed.
+        if self._ap is not None:
+            bssid = binascii.hexlify(self._ap[1]).decode()
+            channel = self._ap[2]
+        elif self._cache:
+            bssid = self._cache['bssid']
+            channel = self._cache['channel']
+        else:
+            return
+        cache = {'ssid': ssid, 'bssid': bssid, 'channel': channel,
+            'ifconfig': list(self.wlan.ifconfig())}
+        if cache == self._cache:
+            return
+        self._cache = cache
+        try:
+            with open(WIFI_CACHE, 'w') as f:
+                ujson.dump(cache, f)
+        except OSError:
+            pass
 
     def check(self, ssid, pwd):
         # State machine for connecting and reconnecting to an access point.
         # Call this periodically and it returns the state short code
+        now = time.time()
         for _i in [1]:
             if self._check_state == 'find':
-                # scan only every so often
-                if self._last_scan + self.scan_rate > time.time():
+                # First try the AP and IP config that worked last time
+                if (not self._fast_tried and self._cache and
+                        self._cache.get('ssid') == ssid):
+                    self._fast_tried = True
+                    if self._connect_fast(ssid, pwd):
+                        self._ap = None
+                        self._fast = True
+                        self._try_until = now + FAST_TIMEOUT
+                        self._check_state = 'trying'
+                        break
+                # scan only every so often, less often the longer it's down
+                if now < self._next_scan:
                     break
                 # Scan and return if AP not found
-                self._last_scan = time.time()
-                if self.find(ssid) == False:
+                self._ap = self._find_ap(ssid)
+                if self._ap is None:
+                    self._next_scan = now + self.scan_rate
+                    self.scan_rate = min(self.scan_rate * 2, SCAN_MAX)
                     break
-                # Try to connect to AP
+                # Try to connect to the AP found, with DHCP
+                if not self._dhcp():
+                    print('WARN: static IP config stuck, DHCP off')
+                self.wlan.connect(ssid, pwd, bssid=self._ap[1])
+                self._fast = False
+                self._try_until = now + TRY_TIMEOUT
                 self._check_state = 'trying'
-                self.connect(ssid, pwd)
                 break
             elif self._check_state == 'trying':
                 if self.is_connected:
                     self._check_state = 'connected'
+                    self.scan_rate = SCAN_MIN
+                    # Only a config from DHCP, or the cached one that just
+                    # worked, goes in the cache
+                    if self._fast or not self._static:
+                        self._save_cache(ssid)
+                elif now >= self._try_until:
+                    self.wlan.disconnect()
+                    self._check_state = 'find'
+                    if self._fast:
+                        self._next_scan = now   # scan right away
+                    else:
+                        self._next_scan = now + self.scan_rate
+                        self.scan_rate = min(self.scan_rate * 2, SCAN_MAX)
             elif self._check_state == 'connected':
                 if not self.is_connected:
                     self._check_state = 'find'
+                    self._fast_tried = False
         return self.stat_code[self._check_state]
         
+    def resolve_url(self, url):
+        # Look up the host of url if its cached address is missing or stale.
+        # getaddrinfo() blocks everything, uasyncio tasks too, so call this
+        # where a hold up is fine (e.g. right after connecting), not in the
+        # upload path.
+        host, port, _ = self._split_url(url)
+        try:
+            resolver.resolve(host, port)
+        except OSError:
+            pass
+
+    def _split_url(self, url):
+        # Returns host, port and path (without the leading '/') of url. url
+        # can also be bytes-like, e.g. a memoryview of a URL made in a
+        # buffer. Then the path is a memoryview into it, not a copy.
+        if not isinstance(url, str):
+            return self._split_url_buf(memoryview(url))
+        if url.count('/') < 3:
+            url = url.strip() + '/'
+        _, _, host, path = url.split('/', 3)
+        port = 80
+        if ':' in host:
+            host, port = host.split(':')
+            port = int(port)
+        return host, port, path
+
+    def _split_url_buf(self, mv):
+        # Find the slashes of http://host/path
+        slashes = 0
+        start = i = 0
+        while i < len(mv):
+            if mv[i] == 47:     # '/'
+                slashes += 1
+                if slashes == 2:
+                    start = i + 1
+                elif slashes == 3:
+                    break
+            i += 1
+        host = str(bytes(mv[start:i]), 'ascii')
+        path = mv[i + 1:] if i < len(mv) else b''
+        port = 80
+        if ':' in host:
+            host, port = host.split(':')
+            port = int(port)
+        return host, port, path
+
+    def _head(self, method, host, path, http11=True, ctype=None, length=0):
+        # Put the request line and headers in the request buffer. Returns a
+        # memoryview of them, or None if they don't fit.
+        buf = self._req
+        pos = put_str(buf, 0, method)
+        pos = put_str(buf, pos, b' /')
+        pos = put_str(buf, pos, path)
+        pos = put_str(buf, pos, b' HTTP/1.1\r\nHost: ' if http11 else b' HTTP/1.0\r\nHost: ')
+        pos = put_str(buf, pos, host)
+        if http11:
+            pos = put_str(buf, pos, b'\r\nConnection: keep-alive')
+        if ctype:
+            pos = put_str(buf, pos, b'\r\nContent-Type: ')
+            pos = put_str(buf, pos, ctype)
+            pos = put_str(buf, pos, b'\r\nContent-Length: ')
+            pos = put_int(buf, pos, length)
+        pos = put_str(buf, pos, b'\r\n\r\n')
+        if pos > len(buf):
+            print('ERR: request too long')
+            return None
+        return self._reqv[:pos]
+
     def http_get(self, url, full=False):
         # Use this for posting only; throws away received data. Returns
-        # True if successful. Gets only first 50 bytes unless full=True
+        # True if successful. Gets only first 50 bytes unless full=True.
+        # url is a str or bytes-like (see _split_url()).
         # Return codes:
         #   ntc = not connected
         #   ok = request success. Got 'OK' and '200'.
@@ -120,15 +409,12 @@ class WIFI:
         if not self._is_connected:
             return 'ntc'
 
-        if url.count('/') < 3:
-            url = url.strip() + '/'
-        _, _, host, path = url.split('/', 3)
-
+        host, port, path = self._split_url(url)
         status = ''
         
         for i in [1]:   # Loop only once. Use loop for convenience using "break".
             try:
-                addr = socket.getaddrinfo(host, 80)[0][-1]
+                addr = socket.getaddrinfo(resolver.resolve(host, port), port)[0][-1]
                 s = socket.socket()
             except OSError:
                 print('ERR: Could not open socket')
@@ -137,8 +423,12 @@ class WIFI:
             try:
                 s.settimeout(SOCK_TIMEOUT)
                 s.connect(addr)
-                s.send(bytes('GET /%s HTTP/1.0\r\nHost: %s\r\n\r\n' % (path, host), 'utf8'))
+                head = self._head('GET', host, path, http11=False)
+                if head is None:
+                    raise OSError('request too long')
+                s.send(head)
             except OSError:
+                resolver.forget(host)
                 print('ERR: connect() or send() resulted in error')
                 status = 'er2'
                 break
@@ -164,3 +454,182 @@ class WIFI:
         except NameError:
             pass
         return status
+
+    async def http_get_async(self, url):
+        # Same as http_get() but awaitable. url can be a str or bytes-like.
+        # The socket is non-blocking so other tasks keep running while
+        # waiting on a slow hotspot. Each step is limited to SOCK_TIMEOUT.
+        # The connection is kept open for the next request to the same host.
+        # There is no DNS lookup here, as getaddrinfo() would block the
+        # other tasks: the host's address must have been looked up with
+        # resolve_url() beforehand.
+        # Return codes are the same as http_get():
+        #   er1 = could not connect (no address yet, or TCP)
+        #   er2 = send error
+        #   er3 = receive error or no response
+        return await self._request_async('GET', url)
+
+    async def http_post_async(self, url, body, ctype='application/json'):
+        # Awaitable POST of body (any bytes-like object, e.g. a memoryview
+        # into a reused buffer). Return codes are as http_get_async(). Any
+        # 2xx status (Thingspeak answers bulk updates with 202) is 'ook'.
+        return await self._request_async('POST', url, body, ctype)
+
+    async def _request_async(self, method, url, body=None, ctype=None):
+        # HTTP/1.1 request on the kept-alive connection to the host. If a
+        # reused connection turns out to be dead (the server closes idle
+        # ones), try once more on a fresh one. Only if the send failed, or
+        # for a GET: a POST that failed on the response may have gone
+        # through, and a bulk update sent twice posts the samples twice.
+        if not self._is_connected:
+            await self.http_close()
+            return 'ntc'
+
+        host, port, path = self._split_url(url)
+        for attempt in (1, 2):
+            status, reused = await self._request_once(method, host, port, path, body, ctype)
+            if not (reused and (status == 'er2' or (status == 'er3' and body is None))):
+                break
+            print('WARN: kept-alive connection failed, reconnecting')
+        return status
+
+    async def _open(self, host, port):
+        # Returns reader, writer and whether it is a reused connection. One
+        # left idle for long is likely closed by the server by now, and a
+        # POST can't be sent again if that shows only on the response.
+        conn = self._conn
+        if (conn and conn[0] == host and conn[1] == port and
+                time.ticks_diff(time.ticks_ms(), conn[4]) < KEEP_IDLE_MS):
+            return conn[2], conn[3], True
+        await self.http_close()
+        ip = resolver.cached(host)
+        if ip is None:
+            raise OSError('no address for ' + host)
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip, port), SOCK_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            resolver.forget(host)   # address may have moved
+            raise
+        self._conn = [host, port, reader, writer, time.ticks_ms()]
+        return reader, writer, False
+
+    async def http_close(self):
+        # Close the kept-alive connection, if any
+        if self._conn:
+            writer = self._conn[3]
+            self._conn = None
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _request_once(self, method, host, port, path, body, ctype):
+        try:
+            reader, writer, reused = await self._open(host, port)
+        except (OSError, asyncio.TimeoutError):
+            print('ERR: Could not connect')
+            return 'er1', False
+
+        status = ''
+        keep = False
+        for i in [1]:   # Loop only once. Use loop for convenience using "break".
+            try:
+                if body is None:
+                    head = self._head(method, host, path)
+                else:
+                    head = self._head(method, host, path, ctype=ctype, length=len(body))
+                if head is None:
+                    raise OSError('request too long')
+                writer.write(head)
+                if body is not None:
+                    writer.write(body)
+                await asyncio.wait_for(writer.drain(), SOCK_TIMEOUT)
+            except (OSError, asyncio.TimeoutError):
+                print('ERR: send resulted in error')
+                status = 'er2'
+                break
+
+            # Status line looks like: HTTP/1.1 200 OK
+            try:
+                line = await asyncio.wait_for(reader.readline(), SOCK_TIMEOUT)
+                print(line)     #DEBUG
+            except (OSError, asyncio.TimeoutError):
+                print('ERR: receive resulted in error')
+                status = 'er3'
+                break
+            parts = line.split()
+            if len(parts) >= 2 and (parts[1] == b'200' or
+                    (body is not None and parts[1][:1] == b'2')):
+                status = 'ook'
+            elif not line:
+                status = 'er3'
+                break
+            else:
+                print('WARN: Did not get 200 OK')
+                status = 'nok'
+
+            # Read the rest of the response so the next one starts in sync
+            try:
+                keep = await asyncio.wait_for(self._skip_response(reader), SOCK_TIMEOUT)
+                keep = keep and len(parts) > 0 and parts[0] != b'HTTP/1.0'
+            except (OSError, asyncio.TimeoutError, ValueError):
+                pass
+
+        if not keep:
+            await self.http_close()
+        elif self._conn:
+            self._conn[4] = time.ticks_ms()
+        return status, reused
+
+    async def _skip_response(self, reader):
+        # Read past the headers and body of a response. Returns False if
+        # the connection can't be used again.
+        length = -1
+        chunked = False
+        keep = True
+        while True:
+            line = await reader.readline()
+            if not line:
+                return False
+            if line == b'\r\n':
+                break
+            i = line.find(b':')
+            name = line[:i].strip().lower()
+            value = line[i + 1:].strip().lower()
+            if name == b'content-length':
+                length = int(value)
+            elif name == b'transfer-encoding':
+                chunked = b'chunked' in value
+            elif name == b'connection':
+                keep = value != b'close'
+
+        if chunked:
+            # Each chunk is: size in hex, CRLF, data, CRLF. Last has size 0
+            # and is followed by optional trailers and a blank line.
+            while True:
+                line = await reader.readline()
+                size = int(line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    break
+                await self._discard(reader, size + 2)
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return False
+                if line == b'\r\n':
+                    break
+        elif length >= 0:
+            await self._discard(reader, length)
+        else:
+            return False    # body runs until the server closes
+        return keep
+
+    async def _discard(self, reader, n):
+        # Read and throw away n bytes
+        while n > 0:
+            data = await reader.read(min(n, 64))
+            if not data:
+                raise OSError('closed')
+            n -= len(data)